@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  apihooks.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides hooks around submitting of pywikibot API requests
+
+A hook is called as hook( request, submit ) for each request and has to
+return the result of submit() or a replacement for it. submit( other ) sends
+another request through the remaining hooks instead, e.g. a copy of request.
+Hooks are called in order of adding, the first added one being the outermost.
+"""
+
+from pywikibot.data import api
+
+# Registered hooks
+_hooks = list()
+
+# Original Request.submit while hooks are installed
+_submit = None
+
+
+def add( hook ):
+    """
+    Register hook, installing the wrapper of Request.submit if needed
+    """
+    global _submit
+
+    if _submit is None:
+        _submit = api.Request.submit
+        api.Request.submit = _hooked_submit
+
+    _hooks.append( hook )
+
+
+def remove( hook ):
+    """
+    Unregister hook, uninstalling the wrapper if no hooks are left
+    """
+    global _submit
+
+    if hook in _hooks:
+        _hooks.remove( hook )
+
+    if not _hooks and _submit is not None:
+        api.Request.submit = _submit
+        _submit = None
+
+
+def is_secret( key ):
+    """
+    Returns True if parameter or response field key holds a secret, e.g.
+    token, lgtoken, logintoken, csrftoken, password or lgpassword
+    """
+    return str( key ).endswith( ( "token", "password" ) )
+
+
+def get_action( request ):
+    """
+    Returns value of action parameter of request
+    """
+    action = getattr( request, "_params", dict() ).get( "action", "" )
+
+    # Parameter values are stored as lists
+    if isinstance( action, list ):
+        action = action[0] if action else ""
+
+    return str( action )
+
+
+def _hooked_submit( request ):
+    """
+    Replacement of Request.submit passing request through hooks
+    """
+    hooks = list( _hooks )
+
+    def call( index, current ):
+        if index == len( hooks ):
+            return _submit( current )
+
+        return hooks[ index ]( current, lambda other=None: call(
+            index + 1, current if other is None else other ) )
+
+    return call( 0, request )
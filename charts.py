@@ -42,19 +42,160 @@ The following parameters are supported:
                   Use for unattended run
 -force-reload     If given, countrylists will be always parsed regardless if
                   needed or not
+
+-memory-budget:MB Stream pages within given memory budget in MiB. Prefetch
+                  depth of summary pages and their CountryLists is adapted
+                  to the budget and peak memory is reported at the end of
+                  the run
+
+-shard-coordinator:queue
+                  Split pages of generator into work units and put them into
+                  given SQLite queue file, then wait for workers to finish
+
+-shard-units:kind Kind of work units queued by coordinator, "countrylist"
+                  (default) for single entries or "page" for whole pages
+
+-shard-worker:queue
+                  Treat work units from given SQLite queue file until it is
+                  drained. Use with -always. Sharded runs do not support
+                  -metrics, -trace, -checkpoint, -resume, -deadline and
+                  -resolve-links
+
+-link-index:file  Store index of artist and song links found in CountryLists
+                  in given file and reuse it in later runs. Links found in
+                  the current run take precedence, stored ones not seen
+                  again for a week are dropped
+
+-resolve-links[:file]
+                  Check names and links of updated entries in one batched
+                  query per summary page: link unlinked names of existing
+                  articles, bypass redirects and unlink disambiguation pages.
+                  Results are cached for a week, in file if given
+
+-metrics:file     Write metrics of run (counters and latency histograms) to
+                  file at the end of the run, in Prometheus textfile format
+                  if file ends with .prom, as JSON otherwise
+
+-trace:file       Write nested spans of run (summary pages, entries,
+                  CountryList fetches and parsing, API requests, saves) to
+                  file in Chrome trace event format, to be viewed in
+                  chrome://tracing or ui.perfetto.dev
+
+-checkpoint[:file]
+                  Record finished summary pages and parsed CountryLists in
+                  given file during the run, removed after the run has
+                  finished (default: charts-checkpoint.jsonl). Concurrent
+                  runs need different files
+
+-resume           Resume an interrupted run from its checkpoint: finished
+                  summary pages are skipped and results of CountryLists are
+                  reused if their revision is unchanged. Implies -checkpoint
+
+-http-cache[:file]
+                  Cache API responses in given SQLite file (default:
+                  charts-http-cache.sqlite). Texts of unchanged revisions
+                  are taken from cache after a cheap revision id check
+
+-http-cache-size:MB
+                  Size limit of response cache in MiB (default: 256)
+
+-http-cache-bypass
+                  Send all requests to wiki but refresh cached responses
+
+-site-cache[:file]
+                  Keep siteinfo and userinfo in given JSON file (default:
+                  charts-site-cache.json) and reuse them in later runs:
+                  siteinfo for a day, userinfo while the login cookies are
+                  unchanged. Tokens are always requested from the wiki
+
+-site-cache-session:hours
+                  Reuse userinfo for given hours at most (default: 6)
+
+-deadline:minutes Time budget of run. Entries are treated by priority
+                  (highlighted ones, then changed CountryLists, most recently
+                  changed first) and no new work is started when the budget
+                  would be exceeded. Finished work is saved and deferred
+                  pages and entries are reported
+
+-categories:list  Comma separated chart categories whose latest entries are
+                  extracted in every parse of a CountryList, besides those
+                  of the entries linking it on the summary page (default:
+                  none). Entries of other categories than Singles use
+                  template "/Eintrag <category>"
+
+-change-feed:target
+                  After saving a summary page, append its changed entries
+                  (country, category, CountryList revision, old and new
+                  Interpret, Titel and Chartein) as JSON lines to given
+                  file, or send them to a Unix socket with "unix:path"
+
+-single-flight[:file]
+                  Coordinate with other bot processes running at the same
+                  time through given SQLite file (default:
+                  charts-single-flight.sqlite): existence and revision of
+                  each CountryList is looked up and each revision is parsed
+                  by only one of them, the others reuse the results
+
+-record-traffic:file
+                  Record all API requests and responses of the run with
+                  their durations into given gzipped archive
+
+-replay-traffic:file
+                  Answer all API requests from archive written with
+                  -record-traffic instead of sending them to the wiki, to
+                  reproduce a recorded run
+
+-replay-timing    While replaying, take as long as the recorded requests
+
+-request-timeout:s
+                  Give up read requests not answered within given seconds
+                  and retry them. Entries whose CountryList still can not be
+                  read keep their old values, pages which can not be read
+                  are left for the next run
+
+-request-retries:n
+                  Number of retries of timed out or failed read requests,
+                  after a randomized pause doubling each time (default: 2).
+                  Replaces the retries of pywikibot for them
+
+-request-hedge:s  Send a duplicate of read requests not answered within
+                  given seconds and take the first answer. Needs
+                  -request-timeout
+
+-profile[:file]   If given, run is profiled with cProfile and tracemalloc and
+                  a report per summary page and CountryList is written to file
+                  (default: charts-profile.txt)
 """
 
 
 import locale
 import os
+import random
 import sys
+import time
 
 import pywikibot
 from pywikibot import pagegenerators
 
 import jogobot
 
+import checkpoint
+import coordination
+import deadline
+import feed
+import httpcache
+import metrics
+import profiling
+import shard
+import sitecache
+from countrylist import CountryList
+from linkindex import LinkIndex
+from linkresolver import LinkResolver
+import streaming
 from summarypage import SummaryPage
+import timeouts
+import tracing
+import traffic
 
 # This is required for the text that is shown when you run this script
 # with the parameter -help.
@@ -70,7 +211,15 @@ class ChartsBot( ):
     CountryLists
     """
 
-    def __init__( self, generator, always, force_reload ):
+    # Number of retries and base delay in seconds when saving fails due to
+    # edit conflict
+    conflict_retries = 3
+    conflict_backoff = 2
+
+    def __init__( self, generator, always, force_reload, memory_budget=None,
+                  link_index=None, resolve_links=None, collector=None,
+                  tracer=None, checkpoint_file=None, resume=False,
+                  time_budget=None, change_feed=None ):
         """
         Constructor.
 
@@ -83,6 +232,29 @@ class ChartsBot( ):
         @param force-reload: If given, countrylists will be always parsed
                              regardless if needed or not
         @type force-reload: bool
+        @param memory_budget: Memory budget in bytes, if given pages are
+                              streamed and peak memory is reported
+        @type memory_budget: int
+        @param link_index: Path of file to store index of artist and song
+                           links between runs
+        @type link_index: str
+        @param resolve_links: If True, or path of cache file, links of
+                              updated entries are checked in batched queries
+        @type resolve_links: bool, str
+        @param collector: Active Metrics instance to write metrics of run
+                          with
+        @type collector: metrics.Metrics
+        @param tracer: Active Tracer instance to write spans of run with
+        @type tracer: tracing.Tracer
+        @param checkpoint_file: Path of file to record progress of run in
+        @type checkpoint_file: str
+        @param resume: Resume interrupted run from checkpoint_file
+        @type resume: bool
+        @param time_budget: Seconds the run may take
+        @type time_budget: float
+        @param change_feed: File or "unix:" and socket path to write
+                            changed entries of saved pages to
+        @type change_feed: str
         """
 
         self.generator = generator
@@ -91,12 +263,46 @@ class ChartsBot( ):
         # Force parsing of countrylist
         self.force_reload = force_reload
 
+        # Streaming mode
+        self.memory_budget = memory_budget
+
+        # Collect metrics of run
+        self.metrics = collector
+
+        # Record spans of run
+        self.tracer = tracer
+
+        self.checkpoint_file = checkpoint_file
+        self.resume = resume
+
+        # Limit time of run, remembering deferred pages and entries
+        self.time_budget = time_budget
+        self.deferred = list()
+
+        # Publish changed entries of saved pages
+        if change_feed:
+            self.feed = feed.ChangeFeed( change_feed )
+        else:
+            self.feed = None
+
+        # Share links found in CountryLists between all of them
+        CountryList.link_index = LinkIndex( link_index )
+
         # Output Information
         jogobot.output( "Chartsbot invoked" )
 
         # Save pywikibot site object
         self.site = pywikibot.Site()
 
+        # Fit CountryList texts preloaded per summary page into budget
+        SummaryPage.memory_budget = memory_budget
+
+        # Check links of updated entries
+        if resolve_links:
+            SummaryPage.link_resolver = LinkResolver(
+                self.site, resolve_links if resolve_links is not True else
+                None )
+
         # Define edit summary
         self.summary = jogobot.config["charts"]["edit_summary"].strip()
 
@@ -109,11 +315,68 @@ class ChartsBot( ):
 
     def run(self):
         """Process each page from the generator."""
+        if self.checkpoint_file:
+            CountryList.checkpoint = checkpoint.Checkpoint(
+                self.checkpoint_file, self.resume )
+        if self.time_budget:
+            deadline.Deadline( self.time_budget ).activate()
+        start = time.time()
+        success = False
+
         # Count skipped pages (redirect or missing)
         skipped = 0
-        for page in self.generator:
-            if not self.treat(page):
-                skipped += 1
+        try:
+            with tracing.span( "Run", "run" ):
+                for page in self.generator:
+
+                    # Page was finished by interrupted run
+                    if( CountryList.checkpoint and
+                            CountryList.checkpoint.is_page_done(
+                                page.title() ) ):
+                        metrics.inc( "pages", result="resumed" )
+                        continue
+
+                    # Not enough time left to start another page
+                    if not deadline.allows():
+                        self.deferred.append( page.title( asLink=True ) )
+                        metrics.inc( "pages", result="deferred" )
+                        continue
+
+                    deferred = len( self.deferred )
+
+                    # Page is left untouched and not marked as done, like
+                    # entries whose CountryList timed out or pages which
+                    # could not be loaded or saved
+                    try:
+                        with tracing.span( "SummaryPage", "page",
+                                           title=page.title() ):
+                            if not self.treat(page):
+                                skipped += 1
+                                continue
+                    except timeouts.RequestTimeout as error:
+                        jogobot.output( "Page {page} not treated: {error}"
+                                        .format( page=page.title(
+                                            asLink=True ), error=error ),
+                                        "WARNING" )
+                        metrics.inc( "pages", result="timed_out" )
+                        skipped += 1
+                        continue
+
+                    # Pages with deferred entries need to be resumed
+                    if( CountryList.checkpoint and
+                            deferred == len( self.deferred ) ):
+                        CountryList.checkpoint.page_done( page.title() )
+            success = True
+        finally:
+            if deadline.Deadline.active:
+                deadline.Deadline.active.deactivate()
+            if CountryList.checkpoint:
+                CountryList.checkpoint.close( finished=success )
+                CountryList.checkpoint = None
+            if self.metrics:
+                self.write_metrics( time.time() - start, success )
+            if self.tracer:
+                self.tracer.write()
 
         if skipped:
             jogobot.output( "Chartsbot finished, {skipped} page(s) skipped"
@@ -121,38 +384,117 @@ class ChartsBot( ):
         else:
             jogobot.output( "Chartsbot finished successfully" )
 
+        if self.feed:
+            jogobot.output( "{count} changed entries written to {target}"
+                            .format( count=self.feed.count,
+                                     target=self.feed.target ) )
+
+        if self.deferred:
+            jogobot.output( ( "Deadline reached, {count} page(s)/entries " +
+                              "deferred: {deferred}" ).format(
+                count=len( self.deferred ),
+                deferred=", ".join( self.deferred ) ), "WARNING" )
+
+        CountryList.link_index.save()
+
+        if SummaryPage.link_resolver:
+            SummaryPage.link_resolver.save()
+
+        if self.memory_budget:
+            self.output_peak_memory()
+
+    def write_metrics( self, duration, success ):
+        """Write collected metrics of run to file."""
+        metrics.gauge( "run_duration_seconds", duration )
+        metrics.gauge( "run_success", int( success ) )
+        metrics.gauge( "run_timestamp_seconds", int( time.time() ) )
+
+        if self.memory_budget:
+            metrics.gauge( "peak_memory_bytes", max(
+                streaming.peak_memory() or 0,
+                getattr( self.generator, "peak", 0 ) ) )
+
+        self.metrics.write()
+
+    def output_peak_memory( self ):
+        """Report peak memory usage of run against memory budget."""
+        peak = max( streaming.peak_memory() or 0,
+                    getattr( self.generator, "peak", 0 ) )
+
+        jogobot.output( ( "Peak memory usage {peak:.1f} MiB " +
+                          "(budget {budget:.1f} MiB)" ).format(
+                              peak=peak / 2**20,
+                              budget=self.memory_budget / 2**20 ) )
+
     def treat(self, page):
-        """Load the given page, does some changes, and saves it."""
-        text = self.load(page)
+        """
+        Load the given page, does some changes, and saves it.
+
+        @returns  True if page was saved or did not need to be saved, False
+                  if it could not be loaded or saved
+        @rtype    bool
+        """
+        with metrics.timer( "phase_duration_seconds", phase="load" ), \
+                tracing.span( "Load", "page" ):
+            text = self.load(page)
         if not text:
+            metrics.inc( "pages", result="skipped" )
             return False
 
         ################################################################
         # NOTE: Here you can modify the text in whatever way you want. #
         ################################################################
 
-        # Initialise and treat SummaryPageWorker
-        sumpage = SummaryPage( text, self.force_reload )
-        sumpage.treat()
-
-        # Check if editing is needed and if so get new text
-        if sumpage.get_new_text():
-            text = sumpage.get_new_text()
-
-        if not self.save(text, page, self.summary, False):
+        with profiling.section( "SummaryPage " + page.title(asLink=True) ), \
+                metrics.timer( "phase_duration_seconds", phase="treat" ), \
+                tracing.span( "Treat", "page" ):
+
+            # Initialise and treat SummaryPageWorker
+            sumpage = SummaryPage( text, self.force_reload )
+            sumpage.treat()
+
+            # Remember entries left out due to deadline
+            for entry in sumpage.deferred:
+                self.deferred.append( "{page}: {liste}".format(
+                    page=page.title( asLink=True ),
+                    liste=entry.get( "Liste" ).value.strip()
+                    if entry.has( "Liste" ) else entry ) )
+            metrics.inc( "entries", len( sumpage.deferred ),
+                         result="deferred" )
+
+            # Check if editing is needed and if so get new text
+            if sumpage.get_new_text():
+                text = sumpage.get_new_text()
+
+            # New text is extracted, parse tree is not needed any more
+            sumpage.release()
+
+        with metrics.timer( "phase_duration_seconds", phase="save" ), \
+                tracing.span( "Save", "page" ):
+            saved = self.save(text, page, self.summary, False,
+                              results=sumpage.get_results())
+
+        if saved:
+            metrics.inc( "pages", result="saved" )
+        elif saved is None:
+            metrics.inc( "pages", result="unchanged" )
+        else:
+            metrics.inc( "pages", result="failed" )
             jogobot.output(u'Page %s not saved.' % page.title(asLink=True))
 
-        return True
+        return saved is not False
 
-    def load(self, page):
+    def load(self, page, force=False):
         """Load the text of the given page."""
         try:
             # Load the page
-            text = page.get()
+            text = page.get(force=force)
         except pywikibot.NoPage:
+            metrics.inc( "errors", type="NoPage" )
             jogobot.output( u"Page %s does not exist; skipping."
                             % page.title(asLink=True), "ERROR" )
         except pywikibot.IsRedirectPage:
+            metrics.inc( "errors", type="IsRedirectPage" )
             jogobot.output( u"Page %s is a redirect; skipping."
                             % page.title(asLink=True), "ERROR" )
         else:
@@ -160,8 +502,22 @@ class ChartsBot( ):
         return False
 
     def save(self, text, page, comment=None, minorEdit=True,
-             botflag=True):
-        """Update the given page with new text."""
+             botflag=True, results=None, applied=None):
+        """
+        Update the given page with new text.
+
+        If results of the summary page entries are given, edit conflicts are
+        resolved by applying them to the current text of the page again.
+        Changes of the results applied to the saved text (all results if
+        applied is not given) are written to the change feed.
+
+        @returns  True if page was saved, None if there was nothing to save
+                  and False if saving failed or was declined
+        @rtype    bool
+        """
+        if applied is None:
+            applied = results
+
         # only save if something was changed (and not just revision)
         if text != page.get():
 
@@ -179,26 +535,85 @@ class ChartsBot( ):
             if self.always or pywikibot.input_yn(
                     u'Do you want to accept these changes?',
                     default=False, automatic_quit=False):
-                try:
-                    page.text = text
-                    # Save the page
-                    page.save(summary=comment or self.comment,
-                              minor=minorEdit, botflag=botflag)
-                except pywikibot.LockedPage:
-                    jogobot.output( u"Page %s is locked; skipping."
-                                    % page.title(asLink=True), "ERROR" )
-                except pywikibot.EditConflict:
-                    jogobot.output(
-                        u'Skipping %s because of edit conflict'
-                        % (page.title()), "ERROR")
-                except pywikibot.SpamfilterError as error:
-                    jogobot.output(
-                        u'Cannot change %s because of spam blacklist \
+
+                for attempt in range( type( self ).conflict_retries + 1 ):
+                    try:
+                        page.text = text
+                        # Save the page
+                        page.save(summary=comment or self.comment,
+                                  minor=minorEdit, botflag=botflag)
+                    except pywikibot.LockedPage:
+                        metrics.inc( "errors", type="LockedPage" )
+                        jogobot.output( u"Page %s is locked; skipping."
+                                        % page.title(asLink=True), "ERROR" )
+                    except pywikibot.EditConflict:
+                        metrics.inc( "errors", type="EditConflict" )
+                        if( results is not None and
+                            attempt < type( self ).conflict_retries ):
+                            text, applied = self.rebase( page, results,
+                                                         attempt )
+                            if text:
+                                continue
+                            elif text is None:
+                                return None
+                        else:
+                            jogobot.output(
+                                u'Skipping %s because of edit conflict'
+                                % (page.title()), "ERROR")
+                    except pywikibot.SpamfilterError as error:
+                        metrics.inc( "errors", type="SpamfilterError" )
+                        jogobot.output(
+                            u'Cannot change %s because of spam blacklist \
 entry %s'
-                        % (page.title(), error.url), "ERROR")
-                else:
-                    return True
-        return False
+                            % (page.title(), error.url), "ERROR")
+                    else:
+                        if self.feed and applied:
+                            self.feed.emit(
+                                page.title(),
+                                SummaryPage.get_changes( applied ) )
+                        return True
+                    break
+            return False
+        return None
+
+    def rebase(self, page, results, attempt):
+        """
+        Reload page after an edit conflict and apply already computed results
+        of summary page entries to its current text.
+
+        @param page: Page which could not be saved
+        @type page: pywikibot.Page
+        @param results: Results of summary page entries as returned by
+                        SummaryPage.get_results()
+        @type results: dict
+        @param attempt: Number of failed attempt, used for backoff
+        @type attempt: int
+
+        @returns  New text, None if there is nothing left to save or False
+                  if page could not be loaded, and results applied to it
+        @rtype    tuple
+        """
+        jogobot.output( u"Edit conflict on %s, reapplying results to current "
+                        u"text" % page.title(asLink=True), "WARNING" )
+
+        # Wait with exponential backoff and some jitter
+        time.sleep( type( self ).conflict_backoff * 2 ** attempt *
+                    random.uniform( 0.5, 1.5 ) )
+
+        text = self.load(page, force=True)
+        if not text:
+            return False, None
+
+        current = text
+        sumpage = SummaryPage( current )
+        text = sumpage.apply( results )
+
+        if text == current:
+            jogobot.output( u"Page %s already up to date after edit conflict"
+                            % page.title(asLink=True) )
+            return None, None
+
+        return text, sumpage.applied
 
 
 def main(*args):
@@ -248,25 +663,264 @@ def main(*args):
         # if parsing is needed or not
         force_reload = False
 
+        # If memory_budget is set, pages will be streamed within it
+        memory_budget = None
+
+        # Path of file to store link index in
+        link_index = None
+
+        # Check links of updated entries, maybe caching in given file
+        resolve_links = None
+
+        # Path of file to write metrics to
+        metrics_file = None
+
+        # Path of file to write trace to
+        trace_file = None
+
+        # Time budget of run in seconds
+        time_budget = None
+
+        # Path of checkpoint file and wether to resume from it
+        checkpoint_file = None
+        resume = False
+
+        # Sharded run, path of queue for coordinator or worker
+        shard_coordinator = None
+        shard_worker = None
+        shard_units = "countrylist"
+
+        # Cache API responses in given file
+        http_cache = None
+        http_cache_size = None
+        http_cache_bypass = False
+
+        # Keep startup requests in given file
+        site_cache = None
+        site_cache_session = None
+
+        # Write changed entries to given file or socket
+        change_feed = None
+
+        # Share lookups and parsing with concurrent processes
+        single_flight = None
+
+        # Record API traffic to or replay it from given archive
+        record_traffic = None
+        replay_traffic = None
+        replay_timing = False
+
+        # Bound duration of read requests
+        request_timeout = None
+        request_retries = 2
+        request_hedge = None
+
+        # If profile is set, run will be profiled and report written to it
+        profile = None
+
         # Parse command line arguments
         for arg in local_args:
             if arg.startswith("-always"):
                 always = True
             elif arg.startswith("-force-reload"):
                 force_reload = True
+            elif arg.startswith("-memory-budget:"):
+                memory_budget = int(
+                    float( arg[len("-memory-budget:"):] ) * 2**20 )
+            elif arg.startswith("-link-index:"):
+                link_index = arg[len("-link-index:"):]
+            elif arg.startswith("-resolve-links"):
+                resolve_links = arg[len("-resolve-links:"):] or True
+            elif arg.startswith("-metrics:"):
+                metrics_file = arg[len("-metrics:"):]
+            elif arg.startswith("-categories:"):
+                CountryList.extra_categories = tuple(
+                    category.strip() for category in
+                    arg[len("-categories:"):].split(",") if category.strip() )
+            elif arg.startswith("-deadline:"):
+                time_budget = float( arg[len("-deadline:"):] ) * 60
+            elif arg.startswith("-checkpoint"):
+                checkpoint_file = ( arg[len("-checkpoint:"):] or
+                                    "charts-checkpoint.jsonl" )
+            elif arg == "-resume":
+                resume = True
+            elif arg.startswith("-change-feed:"):
+                change_feed = arg[len("-change-feed:"):]
+            elif arg.startswith("-single-flight"):
+                single_flight = ( arg[len("-single-flight:"):] or
+                                  "charts-single-flight.sqlite" )
+            elif arg.startswith("-record-traffic:"):
+                record_traffic = arg[len("-record-traffic:"):]
+            elif arg.startswith("-replay-traffic:"):
+                replay_traffic = arg[len("-replay-traffic:"):]
+            elif arg == "-replay-timing":
+                replay_timing = True
+            elif arg.startswith("-request-timeout:"):
+                request_timeout = float( arg[len("-request-timeout:"):] )
+            elif arg.startswith("-request-retries:"):
+                request_retries = int( arg[len("-request-retries:"):] )
+            elif arg.startswith("-request-hedge:"):
+                request_hedge = float( arg[len("-request-hedge:"):] )
+            elif arg.startswith("-http-cache-size:"):
+                http_cache_size = int(
+                    arg[len("-http-cache-size:"):] ) * 1024**2
+            elif arg == "-http-cache-bypass":
+                http_cache_bypass = True
+            elif arg.startswith("-http-cache"):
+                http_cache = ( arg[len("-http-cache:"):] or
+                               "charts-http-cache.sqlite" )
+            elif arg.startswith("-site-cache-session:"):
+                site_cache_session = float(
+                    arg[len("-site-cache-session:"):] ) * 3600
+            elif arg.startswith("-site-cache"):
+                site_cache = ( arg[len("-site-cache:"):] or
+                               "charts-site-cache.json" )
+            elif arg.startswith("-trace:"):
+                trace_file = arg[len("-trace:"):]
+            elif arg.startswith("-shard-coordinator:"):
+                shard_coordinator = arg[len("-shard-coordinator:"):]
+            elif arg.startswith("-shard-worker:"):
+                shard_worker = arg[len("-shard-worker:"):]
+            elif arg.startswith("-shard-units:"):
+                shard_units = arg[len("-shard-units:"):]
+            elif arg.startswith("-profile"):
+                profile = arg[len("-profile:"):] or "charts-profile.txt"
             else:
                 pass
                 genFactory.handleArg(arg)
 
+        # Resuming needs a checkpoint to resume from
+        if resume and not checkpoint_file:
+            checkpoint_file = "charts-checkpoint.jsonl"
+
+        # Sharded runs bypass ChartsBot.run(), which handles these options
+        if shard_worker or shard_coordinator:
+            unsupported = [ name for name, value in (
+                ( "-metrics", metrics_file ), ( "-trace", trace_file ),
+                ( "-checkpoint", checkpoint_file ),
+                ( "-deadline", time_budget ),
+                ( "-resolve-links", resolve_links ) ) if value ]
+
+            if unsupported:
+                jogobot.output( "Not supported in sharded runs: " +
+                                ", ".join( unsupported ), "ERROR" )
+                return
+
+        # Hedging is part of bounding requests
+        if request_hedge and not request_timeout:
+            jogobot.output( "-request-hedge needs -request-timeout", "ERROR" )
+            return
+
         if not gen:
             gen = genFactory.getCombinedGenerator()
-        if gen:
+        if gen and not shard_worker:
             # The preloading generator is responsible for downloading multiple
             # pages from the wiki simultaneously.
-            gen = pagegenerators.PreloadingGenerator(gen)
-            bot = ChartsBot(gen, always, force_reload)
-            if bot:
-                bot.run()
+            if memory_budget:
+                gen = streaming.StreamingPreloader(gen, memory_budget)
+            else:
+                gen = pagegenerators.PreloadingGenerator(gen)
+        if gen or shard_worker:
+            # Hooks added first see the requests first, so record what the
+            # bot got, even if answered from cache
+            if replay_traffic:
+                recording = traffic.TrafficReplayer( replay_traffic,
+                                                     replay_timing )
+                recording.activate()
+            elif record_traffic:
+                recording = traffic.TrafficRecorder( record_traffic )
+                recording.activate()
+
+            # Time and trace requests as the bot sees them, including
+            # retries and hedging by request timeouts
+            if metrics_file:
+                collector = metrics.Metrics( metrics_file )
+                collector.activate()
+            else:
+                collector = None
+
+            if trace_file:
+                tracer = tracing.Tracer( trace_file )
+                tracer.activate()
+            else:
+                tracer = None
+
+            if http_cache:
+                cache = httpcache.ResponseCache( http_cache, http_cache_size,
+                                                 http_cache_bypass )
+                cache.activate()
+
+            if site_cache:
+                startup = sitecache.SiteCache( site_cache,
+                                               site_cache_session )
+                startup.activate()
+
+            if single_flight:
+                flights = coordination.SingleFlight( single_flight )
+                flights.activate()
+
+            # Innermost, so answers from cache or archive are not bounded
+            if request_timeout:
+                bounds = timeouts.RequestTimeouts(
+                    request_timeout, request_retries, request_hedge )
+                bounds.activate()
+
+            try:
+                bot = ChartsBot(gen, always, force_reload, memory_budget,
+                                link_index, resolve_links, collector,
+                                tracer, checkpoint_file, resume,
+                                time_budget, change_feed)
+
+                # Workers take their pages from queue, not from generator
+                if shard_worker:
+                    run = shard.ShardWorker(
+                        bot, shard.WorkQueue(shard_worker) ).run
+                elif shard_coordinator:
+                    run = shard.ShardCoordinator(
+                        bot, shard.WorkQueue(shard_coordinator),
+                        shard_units ).run
+                else:
+                    run = bot.run
+
+                if profile:
+                    profiling.Profiler( profile ).runcall( run )
+                else:
+                    run()
+            finally:
+                if request_timeout:
+                    bounds.deactivate()
+
+                if single_flight:
+                    flights.deactivate()
+
+                if site_cache:
+                    startup.deactivate()
+
+                if http_cache:
+                    cache.deactivate()
+
+                if tracer:
+                    tracer.deactivate()
+
+                if collector:
+                    collector.deactivate()
+
+                if replay_traffic:
+                    recording.deactivate()
+                    jogobot.output( ( "Replayed {count} request(s), " +
+                                      "{unused} recorded request(s) " +
+                                      "unused" ).format(
+                        count=len( recording.used ),
+                        unused=recording.get_unused() ) )
+                    if recording.fallbacks:
+                        jogobot.output( ( "{count} request(s) answered by " +
+                                          "record of other params" ).format(
+                            count=recording.fallbacks ), "WARNING" )
+                elif record_traffic:
+                    recording.deactivate()
+                    jogobot.output( "Recorded {count} request(s) in {path}"
+                                    .format( count=recording.count,
+                                             path=record_traffic ) )
         else:
             pywikibot.showHelp()
 
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  checkpoint.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides a checkpoint of finished summary pages and parsed CountryLists, to
+resume an interrupted run without treating them again
+"""
+
+import json
+import os
+
+import jogobot
+
+
+class Checkpoint():
+    """
+    Records progress of a run in a file with one JSON record per line
+
+    Records are only appended, so the file is cheap to update after each
+    step and an interrupted write costs at most the last record.
+    """
+
+    def __init__( self, path, resume=False ):
+        """
+        Constructor
+
+        @param path: File to store checkpoint in
+        @type path: str
+        @param resume: Load progress from existing file instead of starting
+                       a new checkpoint
+        @type resume: bool
+        """
+        self.path = path
+
+        # Titles of finished summary pages
+        self.pages = set()
+
+        # Key of CountryList -> result of parsing
+        self.countrylists = dict()
+
+        if resume and os.path.exists( self.path ):
+            self.load()
+
+            jogobot.output( ( "Resuming from checkpoint {path}, {pages} " +
+                              "page(s) and {lists} CountryList(s) done" )
+                            .format( path=self.path, pages=len( self.pages ),
+                                     lists=len( self.countrylists ) ) )
+
+        self._fd = open( self.path, "a" if resume else "w",
+                         encoding="utf-8" )
+
+    def load( self ):
+        """
+        Read records from file, ignoring an incomplete last line
+        """
+        with open( self.path, encoding="utf-8" ) as fd:
+            for line in fd:
+                try:
+                    record = json.loads( line )
+                except ValueError:
+                    continue
+
+                if "page" in record:
+                    self.pages.add( record["page"] )
+                elif "countrylist" in record:
+                    self.countrylists[ record["countrylist"] ] = \
+                        record["result"]
+
+    def _append( self, record ):
+        """
+        Write record to file immediately
+        """
+        self._fd.write( json.dumps( record, ensure_ascii=False ) + "\n" )
+        self._fd.flush()
+
+    def is_page_done( self, title ):
+        """
+        Checks wether summary page was finished before
+        """
+        return title in self.pages
+
+    def page_done( self, title ):
+        """
+        Record summary page as finished
+        """
+        self.pages.add( title )
+        self._append( { "page": title } )
+
+    def get_countrylist( self, key, revid ):
+        """
+        Returns stored result of CountryList if it was parsed in given
+        revision, otherwise None
+        """
+        result = self.countrylists.get( key )
+
+        if result and result["revid"] == revid:
+            return result
+
+        return None
+
+    def set_countrylist( self, key, result ):
+        """
+        Record result of parsed CountryList
+        """
+        self.countrylists[ key ] = result
+        self._append( { "countrylist": key, "result": result } )
+
+    def close( self, finished=False ):
+        """
+        Close file, removing it if run finished as nothing is left to resume
+        """
+        self._fd.close()
+
+        if finished:
+            # Maybe removed by hand or another run already
+            try:
+                os.remove( self.path )
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  coordination.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides single-flight coordination of concurrent bot processes on one
+machine, so only one of them fetches or parses a CountryList revision while
+the others wait and reuse its result
+
+Values are shared through a SQLite file. A process computing a value claims
+its key first, others seeing the claim wait for the value. Claims of
+processes which died are taken over after their lease ran out. Values are
+kept for a short time only.
+
+Values are shared with the module function run(). If no SingleFlight is
+active, it just computes them.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SingleFlight():
+    """
+    SQLite based store of shared values with single-flight semantics
+    """
+
+    # Currently active SingleFlight instance, used by module function run()
+    active = None
+
+    # Default seconds values are shared
+    ttl = 60
+
+    # Seconds a claim is honoured by waiting processes
+    lease = 300
+
+    # Seconds between checks for value while waiting
+    poll = 0.2
+
+    def __init__( self, path, ttl=None ):
+        """
+        Constructor
+
+        @param path: Path of SQLite database file
+        @type path: str
+        @param ttl: Default seconds values are shared
+        @type ttl: float
+        """
+        self.path = path
+
+        if ttl is not None:
+            self.ttl = ttl
+
+        self.owner = "{host}:{pid}".format( host=socket.gethostname(),
+                                            pid=os.getpid() )
+        self.connection = None
+
+        # Values may be requested from multiple threads
+        self.lock = threading.Lock()
+
+    def open( self ):
+        """
+        Open (and maybe create) database
+        """
+        # Autocommit mode, transactions are handled explicitly
+        self.connection = sqlite3.connect( self.path, timeout=60,
+                                           isolation_level=None,
+                                           check_same_thread=False )
+
+        with self.transaction() as cursor:
+            cursor.execute( """CREATE TABLE IF NOT EXISTS flights (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                state TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL )""" )
+
+            # Drop expired values of earlier runs
+            cursor.execute( "DELETE FROM flights WHERE expires < ?",
+                            ( time.time(), ) )
+
+    def close( self ):
+        """
+        Close database
+        """
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def activate( self ):
+        """
+        Open database and make this instance the active one
+        """
+        self.open()
+        type( self ).active = self
+
+    def deactivate( self ):
+        """
+        Stop sharing values and close database
+        """
+        if type( self ).active is self:
+            type( self ).active = None
+
+        self.close()
+
+    @contextmanager
+    def transaction( self ):
+        """
+        Runs enclosed statements in an exclusive transaction
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute( "BEGIN IMMEDIATE" )
+
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute( "ROLLBACK" )
+                raise
+            else:
+                cursor.execute( "COMMIT" )
+
+    def claim( self, key ):
+        """
+        Returns shared value of key or claims key if there is neither a
+        value nor a valid claim of another process
+
+        @returns  True and value, or False and None if key was claimed,
+                  None if another process computes value
+        @rtype    tuple or None
+        """
+        with self.transaction() as cursor:
+            row = cursor.execute( "SELECT value, state, owner, expires " +
+                                  "FROM flights WHERE key = ?",
+                                  ( key, ) ).fetchone()
+            now = time.time()
+
+            if row and row[3] > now:
+                if row[1] == "done":
+                    return True, json.loads( row[0] )
+                elif row[2] != self.owner:
+                    return None
+
+            cursor.execute( "INSERT OR REPLACE INTO flights VALUES " +
+                            "( ?, NULL, 'pending', ?, ? )",
+                            ( key, self.owner, now + type( self ).lease ) )
+
+        return False, None
+
+    def run( self, key, compute, ttl=None ):
+        """
+        Returns shared value of key, computing it if no other process does
+
+        @param key: Key identifying value
+        @type key: str
+        @param compute: Called without arguments to compute value, which
+                        must be JSON serializable
+        @type compute: callable
+        @param ttl: Seconds value is shared, default if None
+        @type ttl: float
+        """
+        while True:
+            claimed = self.claim( key )
+
+            if claimed is not None:
+                break
+
+            time.sleep( type( self ).poll )
+
+        found, value = claimed
+
+        if found:
+            return value
+
+        try:
+            value = compute()
+        except BaseException:
+            # Let waiting processes compute value on their own
+            with self.transaction() as cursor:
+                cursor.execute( "DELETE FROM flights WHERE key = ? AND " +
+                                "owner = ?", ( key, self.owner ) )
+            raise
+
+        with self.transaction() as cursor:
+            cursor.execute( "INSERT OR REPLACE INTO flights VALUES " +
+                            "( ?, ?, 'done', ?, ? )",
+                            ( key, json.dumps( value, ensure_ascii=False ),
+                              self.owner,
+                              time.time() + ( ttl or self.ttl ) ) )
+
+        return value
+
+
+def run( key, compute, ttl=None ):
+    """
+    Returns value of key shared by active SingleFlight, if any, otherwise
+    computes it
+
+    @param compute: Called without arguments to compute value
+    @type compute: callable
+    """
+    if SingleFlight.active:
+        return SingleFlight.active.run( key, compute, ttl )
+
+    return compute()
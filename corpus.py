@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  corpus.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Replays CountryList parsing offline against a corpus of stored wikitext
+snapshots and checks the results against expected values
+
+Each snapshot consists of NAME.wiki containing the wikitext and NAME.json
+containing title, link text, revid and expected interpret, titel and
+chartein of the CountryList. Optionally the JSON gives the chart category
+(default "Singles"), expects a parse error by the name of its type
+("expected": {"error": "CountryListEntryError"}) or marks the snapshot as
+written by hand instead of recorded ("synthetic": true).
+
+The following parameters are supported:
+
+-dir:path         Directory of corpus (default: corpus next to this file)
+
+-record:title     Fetch current revision of given CountryList from wiki and
+                  store it with its current parse result as expected values.
+                  Check the stored values by hand! Append |text to give link
+                  text (e.g. for belgian lists "|Wallonien")
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+import pywikibot
+import mwparserfromhell as mwparser
+
+from countrylist import CountryList, CountryListError, OfflinePage
+
+
+class CorpusReplay():
+    """
+    Parses all snapshots of a corpus offline and compares results
+    """
+
+    # Compared attributes of CountryList
+    fields = ( "interpret", "titel", "chartein" )
+
+    def __init__( self, directory ):
+        """
+        Constructor
+
+        @param directory: Directory containing corpus
+        @type directory: str
+        """
+        self.directory = directory
+
+    @staticmethod
+    def serialize( field, value ):
+        """
+        Returns comparable string for value of CountryList attribute
+        """
+        if field == "chartein":
+            return value.strftime( "%Y-%m-%d" )
+
+        return str( value )
+
+    def get_snapshots( self ):
+        """
+        Returns sorted names of snapshots in corpus
+        """
+        if not os.path.isdir( self.directory ):
+            return list()
+
+        return sorted( name[:-len(".json")]
+                       for name in os.listdir( self.directory )
+                       if name.endswith( ".json" ) )
+
+    def get_meta( self, name ):
+        """
+        Returns metadata of snapshot with given name
+        """
+        with open( os.path.join( self.directory, name + ".json" ),
+                   encoding="utf-8" ) as fd:
+            return json.load( fd )
+
+    def load( self, name ):
+        """
+        Load snapshot with given name
+
+        @returns  Metadata of snapshot and CountryList for its text
+        @rtype    tuple
+        """
+        meta = self.get_meta( name )
+
+        with open( os.path.join( self.directory, name + ".wiki" ),
+                   encoding="utf-8" ) as fd:
+            text = fd.read()
+
+        wikilink = mwparser.nodes.Wikilink( meta["title"], meta.get( "text" ) )
+        page = OfflinePage( meta["title"], text, meta.get( "revid", 0 ) )
+
+        return meta, CountryList( wikilink, page,
+                                  meta.get( "category", "Singles" ) )
+
+    def check( self, name ):
+        """
+        Parse snapshot with given name and compare results with expected
+        values
+
+        @returns  Mismatches and parse time in seconds
+        @rtype    tuple
+        """
+        # Parse each snapshot on its own, even if another one has the same
+        # page in another category
+        CountryList.shared_results.clear()
+
+        start = time.perf_counter()
+        try:
+            meta, countrylist = self.load( name )
+            countrylist.parse()
+        except CountryListError as error:
+            elapsed = time.perf_counter() - start
+
+            if( type( error ).__name__ ==
+                    self.get_meta( name )["expected"].get( "error" ) ):
+                return list(), elapsed
+
+            return [ repr( error ) ], elapsed
+
+        elapsed = time.perf_counter() - start
+
+        if "error" in meta["expected"]:
+            return [ "Expected {error}".format(
+                error=meta["expected"]["error"] ) ], elapsed
+
+        errors = list()
+
+        for field in type( self ).fields:
+            value = type( self ).serialize(
+                field, getattr( countrylist, field ) )
+
+            if value != meta["expected"][field]:
+                errors.append( "{field}: {value!r} != {expected!r}"
+                               .format( field=field, value=value,
+                                        expected=meta["expected"][ field ] ) )
+
+        return errors, elapsed
+
+    def replay( self ):
+        """
+        Parse all snapshots and report mismatches and parse time per file
+
+        @returns  Number of failed snapshots
+        @rtype    int
+        """
+        failed = 0
+        total = 0.0
+        names = self.get_snapshots()
+
+        for name in names:
+            errors, elapsed = self.check( name )
+
+            total += elapsed
+            failed += bool( errors )
+
+            print( "{status}  {elapsed:8.2f} ms  {name}".format(
+                status="FAIL" if errors else "ok  ",
+                elapsed=elapsed * 1000, name=name ) )
+            for error in errors:
+                print( "        " + error )
+
+        print( "{count} snapshot(s), {failed} failed, {total:.2f} ms total"
+               .format( count=len( names ), failed=failed,
+                        total=total * 1000 ) )
+
+        return failed
+
+    def record( self, title, text=None ):
+        """
+        Store current revision of CountryList from wiki as snapshot, with its
+        current parse result as expected values
+
+        @param title: Title of CountryList
+        @type title: str
+        @param text: Link text used on summary page
+        @type text: str
+        """
+        countrylist = CountryList( mwparser.nodes.Wikilink( title, text ) )
+        countrylist.parse()
+
+        if text:
+            name = re.sub( r"[^\w()-]+", "_", title + "_" + text )
+        else:
+            name = re.sub( r"[^\w()-]+", "_", title )
+        path = os.path.join( self.directory, name )
+
+        os.makedirs( self.directory, exist_ok=True )
+
+        with open( path + ".wiki", "w", encoding="utf-8" ) as fd:
+            fd.write( countrylist.page.text )
+
+        with open( path + ".json", "w", encoding="utf-8" ) as fd:
+            json.dump( {
+                "title": countrylist.page.title(),
+                "text": text,
+                "revid": countrylist.revid,
+                "expected": { field: type( self ).serialize(
+                    field, getattr( countrylist, field ) )
+                    for field in type( self ).fields } },
+                fd, ensure_ascii=False, indent=4, sort_keys=True )
+
+        print( "Recorded {name}, please check expected values!".format(
+            name=name ) )
+
+
+def main(*args):
+    """
+    Replay corpus or record new snapshots
+    """
+    # Process global arguments to determine desired site
+    local_args = pywikibot.handle_args(args)
+
+    directory = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                              "corpus" )
+    record = list()
+
+    # Parse command line arguments
+    for arg in local_args:
+        if arg.startswith("-dir:"):
+            directory = arg[ len("-dir:"): ]
+        elif arg.startswith("-record:"):
+            record.append( arg[ len("-record:"): ] )
+
+    replay = CorpusReplay( directory )
+
+    if record:
+        for item in record:
+            title, _, text = item.partition( "|" )
+            replay.record( title, text or None )
+    else:
+        sys.exit( 1 if replay.replay() else 0 )
+
+
+if __name__ == "__main__":
+    main()
@@ -26,63 +26,158 @@ Provides a class for handling charts list per country and year
 """
 
 import re
+import html
 import locale
+import functools
 from datetime import datetime
 
 from isoweek import Week
 
 import pywikibot
+from pywikibot.data import api
 import mwparserfromhell as mwparser
 
 import jogobot
 
+import coordination
+import metrics
+import profiling
+from linkindex import LinkIndex
+import streaming
+import tracing
+
 
 class CountryList():
     """
     Handles charts list per country and year
     """
 
-    def __init__( self, wikilink ):
+    # LinkIndex shared by all CountryLists of a run, if any
+    link_index = None
+
+    # Checkpoint of run to reuse and record results in, if any
+    checkpoint = None
+
+    # Chart categories whose latest entries are extracted in every parse,
+    # besides those given per CountryList
+    extra_categories = ()
+
+    # Pages with text preloaded by SummaryPage, by title
+    preloaded = dict()
+
+    # Results per ( wikilink, revid ) and category, to serve CountryLists
+    # of other categories of the same summary page without parsing again
+    shared_results = dict()
+
+    # Seconds results of parsing are shared with concurrent processes
+    shared_ttl = 3600
+
+    # Rows and cells of diffs returned by API action compare
+    diff_rows = re.compile( r"<tr[^>]*>(.*?)</tr>", re.S )
+    diff_cells = re.compile( r'<td[^>]*? class="([^"]*)"[^>]*>(.*?)</td>',
+                             re.S )
+
+    # Wikilinks and templates (group 1) and artist separators (group 2)
+    credit_tokens = re.compile( r"(\[\[.*?\]\]|\{\{.*?\}\})|(" +
+                                LinkIndex.separators.pattern + ")", re.S )
+
+    def __init__( self, wikilink, page=None, category="Singles",
+                  categories=None, latest_revid=None ):
         """
         Generate new instance of class
 
         Checks wether page given with country_list_link exists
 
         @param    wikilink    Wikilink object by mwparser linking CountryList
+        @param    page        Page object to use instead of loading the page
+                              from wiki, e.g. an OfflinePage
+        @param    category    Chart category to get latest entry of, e.g.
+                              "Singles" or "Alben"
+        @param    categories  Chart categories to extract latest entries of
+                              in the same parse, e.g. those of all entries
+                              of the summary page linking this page
+        @param    latest_revid  Latest revision id of page if already looked
+                                up, it is not checked for existence again
 
         @returns  self        Object representing CountryList
                   False       if page does not exists
         """
 
-        # Generate pywikibot site object
-        # @TODO: Maybe store it outside???
-        self.site = pywikibot.Site()
-
         # Set locale to 'de_DE.UTF-8'
         locale.setlocale(locale.LC_ALL, 'de_DE.UTF-8')
 
-        # Generate pywikibot page object
-        self.page = pywikibot.Page( self.site, wikilink.title )
+        if page is None:
+            # Generate pywikibot site object
+            # @TODO: Maybe store it outside???
+            self.site = pywikibot.Site()
+
+            # Use page preloaded with text if any, otherwise generate
+            # pywikibot page object
+            self.page = type( self ).preloaded.get(
+                str( wikilink.title ).strip() )
+            if self.page is None:
+                self.page = pywikibot.Page( self.site, wikilink.title )
+
+        else:
+            self.site = page.site
+            self.page = page
 
         # Store given wikilink for page object
         self.wikilink = wikilink
 
-        # Check if page exits
-        if not self.page.exists():
+        # Chart category to get latest entry of
+        self.category = category
+
+        # Chart categories extracted in one parse, including own
+        self.categories = tuple( sorted(
+            set( categories or () ) | set( type( self ).extra_categories ) |
+            { category } ) )
+
+        # Check if page exits, preloaded pages know their revision already
+        with metrics.timer( "countrylist_duration_seconds", phase="exists",
+                            countrylist=str( wikilink.title ) ), \
+                tracing.span( "Exists", "countrylist",
+                              countrylist=str( wikilink.title ) ):
+            if latest_revid is not None:
+                self.latest_revid = latest_revid
+            elif( type( self ).preloaded.get( str( wikilink.title ).strip() )
+                    is self.page ):
+                self.latest_revid = self.get_latest_revid()
+            else:
+                self.latest_revid = coordination.run(
+                    "revid:{site}:{title}".format(
+                        site=self.site, title=str( wikilink.title ).strip() ),
+                    self.get_latest_revid )
+
+        # Offline pages may have revision 0
+        if self.latest_revid is None:
             raise CountryListError( "CountryList " +
                                     str(wikilink.title) + " does not exists!" )
 
         # Initialise attributes
         __attr = (  "wikicode", "entry", "chartein", "_chartein_raw",
-                    "_titel_raw", "titel", "interpret", "_interpret_raw" )
+                    "_titel_raw", "titel", "interpret", "_interpret_raw",
+                    "_page_links" )
         for attr in __attr:
             setattr( self, attr, None )
 
         self.parsed = False
 
+        # Names no wikilink was found for
+        self.unresolved = list()
+
         # Try to find year
         self.find_year()
 
+    def get_latest_revid( self ):
+        """
+        Returns latest revision id of page, None if it does not exist
+        """
+        if not self.page.exists():
+            return None
+
+        return self.page.latest_revision_id
+
     def is_parsing_needed( self, revid ):
         """
         Check if current revid of CountryList differs from given one
@@ -93,7 +188,7 @@ class CountryList():
                   False       Given revid is equal to current revid
         """
 
-        if revid != self.page.latest_revision_id:
+        if revid != self.latest_revid:
             return True
         else:
             return False
@@ -111,31 +206,468 @@ class CountryList():
         else:
             raise CountryListError( "CountryList year is errorneous!" )
 
-    def parse( self ):
+    def parse( self, saved_revid=0, saved_titel=None ):
         """
         Handles the parsing process
+
+        @param saved_revid: Revision the summary page entry was built from,
+                            only the changes since then are parsed if
+                            possible
+        @type saved_revid: int
+        @param saved_titel: Titel of summary page entry, to check that the
+                            changes follow on its row
+        @type saved_titel: str
         """
 
-        # Set revid
-        self.revid = self.page.latest_revision_id
+        # Reuse result of parsing for another category or of interrupted run
+        if self.restore_shared() or self.restore_result():
+            return
+
+        # Results of parsing in this process, keeping original objects
+        local = dict()
+
+        def compute():
+            local.update( self.parse_revision( saved_revid, saved_titel ) )
+            return type( self ).dump_results( local )
+
+        # Parsing only changes yields own category only, whole page all
+        if saved_revid and saved_titel:
+            mode = "delta"
+            categories = ( self.category, )
+        else:
+            mode = "full"
+            categories = self.categories
+
+        # Concurrent processes parse each revision only once
+        results = coordination.run(
+            "parse:{site}:{link}:{revid}:{mode}:{categories}".format(
+                site=self.site, link=self.wikilink, revid=self.latest_revid,
+                mode=mode, categories="|".join( categories ) ),
+            compute, ttl=type( self ).shared_ttl )
+
+        # Results were parsed by another process
+        reused = not local and self.category in results
+        results = local or type( self ).load_results( results )
+
+        # Shared results lacking own category are not trusted
+        if self.category not in results:
+            results.update( self.parse_revision( saved_revid,
+                                                 saved_titel ) )
 
+        # Serve CountryLists of other categories from this parse
+        type( self ).shared_results.setdefault(
+            ( str( self.wikilink ), self.latest_revid ),
+            dict() ).update( results )
+
+        if isinstance( results[ self.category ], CountryListError ):
+            raise results[ self.category ]
+
+        if reused:
+            self.set_result( results[ self.category ] )
+
+            jogobot.output(
+                "Reused revision {revid} of page [[{title}]] from other "
+                "process".format( revid=self.revid, title=self.page.title() ) )
+
+        if type( self ).checkpoint:
+            type( self ).checkpoint.set_countrylist( self.get_result_key(),
+                                                     self.get_result() )
+
+    def parse_revision( self, saved_revid, saved_titel ):
+        """
+        Parses latest revision of page
+
+        @returns  Mapping of category to result or CountryListError
+        @rtype    dict
+        """
+        with profiling.section( "CountryList " +
+                                self.page.title( asLink=True ) ), \
+                metrics.timer( "countrylist_duration_seconds", phase="parse",
+                               countrylist=self.page.title() ), \
+                tracing.span( "Parse", "countrylist",
+                              countrylist=self.page.title() ):
+
+            # Set revid
+            self.revid = self.latest_revid
+
+            # Rows appended since saved revision can be read from the diff
+            if( saved_revid and saved_titel and
+                    self.parse_delta( saved_revid, saved_titel ) ):
+                results = { self.category: self.get_result() }
+            else:
+                results = self.parse_full()
+
+            if isinstance( results[ self.category ], CountryListError ):
+                return results
+
+            # Make links of this list available for other lists
+            self.index_links()
+
+            # For easy detecting wether we have parsed self
+            self.parsed = True
+
+            # Log parsed page
+            jogobot.output(
+                "Parsed revision {revid} of page [[{title}]]".format(
+                    revid=self.revid, title=self.page.title() ) )
+
+        return results
+
+    @staticmethod
+    def dump_results( results ):
+        """
+        Returns results as returned by parse_revision() as JSON
+        serializable dict, errors as dict of their type and message
+        """
+        return { category: { "error": str( result ),
+                             "type": type( result ).__name__ }
+                 if isinstance( result, CountryListError ) else result
+                 for category, result in results.items() }
+
+    @staticmethod
+    def load_results( results ):
+        """
+        Returns results dumped by dump_results() with errors raisable again
+        """
+        errors = { error.__name__: error for error in
+                   ( CountryListError, CountryListEntryError ) }
+
+        return { category: errors.get( result["type"], CountryListError )(
+                     result["error"] ) if "error" in result else result
+                 for category, result in results.items() }
+
+    def parse_full( self ):
+        """
+        Parses whole page for latest entries of all categories
+
+        @returns  Mapping of category to result or CountryListError
+        @rtype    dict
+        """
         # Parse page with mwparser
         self.generate_wikicode()
 
-        # Select lastest entry
-        self.get_latest_entry()
+        # Select lastest entries of all categories at once
+        categories = [ category for category in self.categories
+                       if category != self.category ] + [ self.category ]
+        entries = self.get_latest_entries( categories )
+
+        # Prepare chartein, titel, interpret per category, own last to
+        # keep its values
+        results = dict()
+        for category in categories:
+            try:
+                self.prepare_category( category, entries )
+            except CountryListError as error:
+                results[ category ] = error
+            else:
+                results[ category ] = self.get_result()
+
+        return results
+
+    def parse_delta( self, saved_revid, saved_titel ):
+        """
+        Prepares latest entry of own category from the changes since saved
+        revision, if they are limited to the end of the wrapping template
+
+        @returns  True if latest entry was prepared from changes
+        @rtype    bool
+        """
+        with tracing.span( "Delta", "countrylist",
+                           countrylist=self.page.title() ):
+            applied = self._parse_delta( saved_revid, str( saved_titel ) )
+
+        metrics.inc( "countrylist_delta",
+                     result="applied" if applied else "fallback" )
+
+        # Links of changed rows must not be used by full parsing
+        if not applied:
+            self.wikicode = None
+            self._page_links = None
+
+        return applied
+
+    def _parse_delta( self, saved_revid, saved_titel ):
+        """
+        Requests diff of category section and prepares its last row
+
+        The diff is only used if its changes form one block directly
+        followed by the closing of the wrapping template and if its old side
+        contains the row the summary page entry was built from. Names not
+        linked in the rows of the diff are searched in the whole list, so
+        the full page is parsed then.
+        """
+        # Offline pages and reverted lists have no usable diff
+        if not self.page.site or saved_revid >= self.revid:
+            return False
+
+        try:
+            section = self.get_section_index()
+
+            if section is None:
+                return False
+
+            tail = type( self ).get_diff_tail(
+                self.get_section_diff( saved_revid, section ) )
+        except pywikibot.Error:
+            return False
+
+        if not tail:
+            return False
+
+        old, new = tail
+
+        # Old side must hold the row the summary page entry was built from
+        titel = " ".join( mwparser.parse( saved_titel ).strip_code().split() )
+        if not any( row.has( "Titel" ) and titel == " ".join(
+                row.get( "Titel" ).value.strip_code().split() )
+                for row in mwparser.parse( old ).ifilter_templates(
+                    recursive=False, matches="Nummer-eins-Hits Zeile" ) ):
+            return False
+
+        self.wikicode = mwparser.parse( new )
+        self._page_links = None
+
+        entry = None
+        for entry in self.wikicode.ifilter_templates(
+                recursive=False, matches="Nummer-eins-Hits Zeile" ):
+            pass
+
+        if entry is None:
+            return False
+
+        # Nothing but whitespace and comments may follow the last row
+        for node in self.wikicode.nodes[ self.wikicode.index( entry ) + 1: ]:
+            if not( isinstance( node, mwparser.nodes.Comment ) or
+                    not str( node ).strip() ):
+                return False
+
+        try:
+            self.prepare_category( self.category, { self.category: entry } )
+        except CountryListError:
+            return False
+
+        return not self.unresolved
+
+    def get_section_index( self ):
+        """
+        Returns index of section of own category in latest revision, as
+        used by API, or None if there is no such section
+        """
+        data = api.Request( site=self.page.site, parameters={
+            "action": "parse", "oldid": self.revid,
+            "prop": "sections" } ).submit()
+
+        belgian = self.detect_belgian()
+        region = None
+
+        for section in data.get( "parse", dict() ).get( "sections", list() ):
+            level = int( section["level"] )
+
+            # Only look into region of belgian lists
+            if belgian:
+                if region is None:
+                    if re.search( belgian, section["line"], re.I ):
+                        region = level
+                    continue
+                elif level <= region:
+                    return None
+
+            if re.search( self.category, section["line"], re.I ):
+                # Sections of transcluded pages can not be compared
+                if not str( section["index"] ).isdigit():
+                    return None
+
+                return section["index"]
+
+        return None
+
+    def get_section_diff( self, saved_revid, section ):
+        """
+        Returns diff of given section between saved and latest revision as
+        HTML table rows
+        """
+        data = api.Request( site=self.page.site, parameters={
+            "action": "compare", "fromrev": saved_revid,
+            "torev": self.revid, "fromsection": section,
+            "tosection": section } ).submit()
+
+        compare = data.get( "compare", dict() )
+
+        return compare.get( "*", compare.get( "body", "" ) )
+
+    @classmethod
+    def get_diff_tail( cls, diff ):
+        """
+        Returns old and new text of the changed block of diff up to the
+        closing of the wrapping template, including context lines before
+
+        @returns  Old and new text or None if diff has more than one block
+                  or it is not followed by the closing of the wrapper
+        @rtype    tuple
+        """
+        blocks = 0
+
+        # Lines as tuples of changed flag, old and new text (None if missing)
+        lines = list()
+
+        for row in cls.diff_rows.findall( diff ):
+            changed, old, new = True, None, None
+
+            for names, content in cls.diff_cells.findall( row ):
+                names = names.split()
+                text = html.unescape( re.sub( r"<[^>]*>", "", content ) )
+
+                if "diff-lineno" in names:
+                    blocks += 1
+                    break
+                elif "diff-context" in names:
+                    changed, old, new = False, text, text
+                elif "diff-deletedline" in names:
+                    old = text
+                elif "diff-addedline" in names:
+                    new = text
+
+            if old is not None or new is not None:
+                lines.append( ( changed, old, new ) )
+
+        if blocks != 1:
+            return None
+
+        changes = [ index for index, line in enumerate( lines ) if line[0] ]
+        if not changes:
+            return None
+
+        # First not empty line after changes must close wrapping template
+        for end in range( changes[-1] + 1, len( lines ) ):
+            if lines[ end ][2].strip():
+                break
+        else:
+            return None
+
+        if not lines[ end ][2].strip().startswith( "}}" ):
+            return None
+
+        return ( "\n".join( line[1] for line in lines[ :end ]
+                            if line[1] is not None ),
+                 "\n".join( line[2] for line in lines[ :end ]
+                            if line[2] is not None ) )
+
+    def prepare_category( self, category, entries ):
+        """
+        Prepare chartein, titel and interpret of latest entry of category
+
+        @param category: Chart category, e.g. "Singles"
+        @type category: str
+        @param entries: Latest entries per category as returned by
+                        get_latest_entries()
+        @type entries: dict
+        """
+        if category not in entries:
+            raise CountryListError( "No {category}-Section found!".format(
+                category=category ) )
+        elif entries[ category ] is None:
+            raise CountryListError( self.page.title() )
+
+        self.entry = entries[ category ]
+
+        # Values of previous category must not be reused
+        self._chartein_raw = None
+        self._titel_raw = None
+        self._interpret_raw = None
+        self.unresolved = list()
 
-        # Prepare chartein, titel, interpret
         self.prepare_chartein()
         self.prepare_titel()
         self.prepare_interpret()
 
-        # For easy detecting wether we have parsed self
+    def get_result_key( self ):
+        """
+        Returns key identifying results of this CountryList, including the
+        link text as it selects the belgian region
+        """
+        return str( self.wikilink ) + "\n" + self.category
+
+    def get_result( self ):
+        """
+        Returns results of parsing as JSON serializable dict
+        """
+        return { "revid": self.revid,
+                 "interpret": str( self.interpret ),
+                 "titel": str( self.titel ),
+                 "chartein": self.chartein.strftime( "%Y-%m-%d" ),
+                 "unresolved": [ str( name ) for name in self.unresolved ] }
+
+    def set_result( self, result ):
+        """
+        Take results of parsing from dict as returned by get_result()
+        """
+        self.revid = result["revid"]
+        self.interpret = result["interpret"]
+        self.titel = result["titel"]
+        self.chartein = datetime.strptime( result["chartein"], "%Y-%m-%d" )
+        self.unresolved = list( result["unresolved"] )
         self.parsed = True
 
-        # Log parsed page
-        jogobot.output( "Parsed revision {revid} of page [[{title}]]".format(
-            revid=self.revid, title=self.page.title() ) )
+    def restore_shared( self ):
+        """
+        Take results from parsing of current revision for another category
+        in this run, if any
+
+        @returns  True if results were restored
+        @rtype    bool
+        """
+        results = type( self ).shared_results.get(
+            ( str( self.wikilink ), self.latest_revid ) )
+
+        if not results or self.category not in results:
+            return False
+
+        if isinstance( results[ self.category ], CountryListError ):
+            raise results[ self.category ]
+
+        self.set_result( results[ self.category ] )
+
+        return True
+
+    def restore_result( self ):
+        """
+        Take results from checkpoint if current revision was parsed before
+
+        @returns  True if results were restored
+        @rtype    bool
+        """
+        if not type( self ).checkpoint:
+            return False
+
+        result = type( self ).checkpoint.get_countrylist(
+            self.get_result_key(), self.latest_revid )
+
+        if not result:
+            return False
+
+        self.set_result( result )
+
+        jogobot.output(
+            "Reused revision {revid} of page [[{title}]] from checkpoint"
+            .format( revid=self.revid, title=self.page.title() ) )
+
+        return True
+
+    def release( self ):
+        """
+        Drops parse tree and page text after results have been extracted to
+        free memory
+        """
+        self.wikicode = None
+        self.entry = None
+        self._page_links = None
+
+        # Preloaded pages may be used by further CountryLists (e.g. other
+        # belgian region), SummaryPage drops them once all entries linking
+        # them are treated
+        if( type( self ).preloaded.get( str( self.wikilink.title ).strip() )
+                is not self.page ):
+            streaming.release_page( self.page )
 
     def detect_belgian( self ):
         """
@@ -156,47 +688,84 @@ class CountryList():
         Runs mwparser on page.text to get mwparser.objects
         """
 
-        self.wikicode = mwparser.parse( self.page.text )
+        with metrics.timer( "countrylist_duration_seconds", phase="text",
+                            countrylist=self.page.title() ), \
+                tracing.span( "Text", "countrylist",
+                              countrylist=self.page.title() ):
+            text = self.page.text
+
+        self.wikicode = mwparser.parse( text )
 
-    def get_latest_entry( self ):
+    def get_latest_entries( self, categories ):
         """
-        Get latest list entry template object
+        Get latest list entry template objects of given chart categories in
+        a single walk over the wikicode
+
+        The first "Nummer-eins-Hits" wrapping template below a heading
+        matching the category is used. For belgian lists the heading must
+        be nested in the section of the region.
+
+        @param categories: Chart categories, e.g. "Singles", "Alben"
+        @type categories: list of str
+        @returns  Mapping of category to latest entry or None if wrapping
+                  template has no entries. Categories without section are
+                  left out.
+        @rtype    dict
         """
-
-        # Select the section "Singles"
-        # For belgian list we need to select subsection of country
         belgian = self.detect_belgian()
 
-        # Select Singles-Section
-        # Catch Error if we have none
-        try:
+        # Titles of headings above current node, by level
+        headings = list()
+        wrappings = dict()
+
+        for node in self.wikicode.ifilter(
+                recursive=True, forcetype=( mwparser.nodes.Heading,
+                                            mwparser.nodes.Template ) ):
+
+            if isinstance( node, mwparser.nodes.Heading ):
+                headings = [ heading for heading in headings
+                             if heading[0] < node.level ]
+                headings.append( ( node.level, str( node.title ) ) )
+                continue
+
+            if "Nummer-eins-Hits" not in str( node.name ):
+                continue
+
+            titles = [ title for level, title in headings ]
+
+            # Only look into region of belgian lists
             if belgian:
-                singles_section = self.wikicode.get_sections(
-                    matches=belgian )[0].get_sections( matches="Singles" )[0]
-            else:
-                singles_section = self.wikicode.get_sections(
-                    matches="Singles" )[0]
+                regions = [ index for index, title in enumerate( titles )
+                            if re.search( belgian, title, re.I ) ]
+                if not regions:
+                    continue
+                titles = titles[ regions[0] + 1: ]
 
-        except IndexError:
-            raise CountryListError( "No Singles-Section found!")
+            for category in categories:
+                if category not in wrappings and any(
+                        re.search( category, title, re.I )
+                        for title in titles ):
+                    wrappings[ category ] = node
 
-        # Since we have multiple categories in some countrys we need
-        # to select the first wrapping template
-        try:
-            wrapping = next( singles_section.ifilter_templates(
-                matches="Nummer-eins-Hits" ) )
-        except StopIteration:
-                raise CountryListError( "Wrapping template is missing!")
+            if len( wrappings ) == len( categories ):
+                break
+
+        entries = dict()
 
         # Select the last occurence of template "Nummer-eins-Hits Zeile" in
         # Wrapper-template
-        for self.entry in wrapping.get("Inhalt").value.ifilter_templates(
-                matches="Nummer-eins-Hits Zeile" ):
-                    pass
+        for category, wrapping in wrappings.items():
+            entries[ category ] = None
 
-        # Check if we have found something
-        if not self.entry:
-            raise CountryListError( self.page.title() )
+            if not wrapping.has( "Inhalt" ):
+                continue
+
+            for entries[ category ] in wrapping.get(
+                    "Inhalt" ).value.ifilter_templates(
+                        matches="Nummer-eins-Hits Zeile" ):
+                pass
+
+        return entries
 
     def get_year_correction( self ):
         """
@@ -207,7 +776,7 @@ class CountryList():
         if self.entry.has( "Jahr" ):
 
             # Read value of param
-            jahr = self.entry.get( "Jahr" ).strip()
+            jahr = str( self.entry.get( "Jahr" ).value ).strip()
 
             if jahr == "+1":
                 return 1
@@ -270,9 +839,22 @@ missing!" )
         if not self._titel_raw:
             self.get_titel_value()
 
-        # Try to find a wikilink for Titel on countrylist
+        # Try to find a wikilink for Titel on countrylist or for the same
+        # artist in LinkIndex
         if "[[" not in self._titel_raw:
-            self.titel = self._search_links( str(self._titel_raw) )
+
+            if type( self ).link_index:
+                if not self._interpret_raw:
+                    self.get_interpret_value()
+
+                fallback = functools.partial(
+                    type( self ).link_index.get_titel,
+                    type( self ).link_index.artist_key( self._interpret_raw ) )
+            else:
+                fallback = None
+
+            self.titel = self._search_links( str(self._titel_raw),
+                                             fallback=fallback )
         else:
             self.titel = self._titel_raw
 
@@ -304,50 +886,73 @@ missing!" )
             self.get_interpret_value()
 
         # Work with interpret value to add missing links
-        # Split it in words
-        words = self._interpret_raw.split()
-
-        # Interpret name separating words
-        seps = ( "feat.", "&" )
-
-        # Create empty list for concatenated interpret names
-        parts = [ " ", ]
-        # Another list for managing indexes which need to be worked on
-        indexes = list()
-        index = 0
-
-        # Reconcatenate interpret names
-        for word in words:
-
-            # Name parts
-            if word not in seps:
-                parts[-1] += (" " + word)
+        # Split it in names and separators
+        parts = type( self ).split_credit( str( self._interpret_raw ) )
 
-                # Remove unnecessary whitespace
-                parts[-1] = parts[-1].strip()
-
-                # We only need to work on it, if no wikilink is present
-                if index not in indexes and "[[" not in parts[-1]:
-                    indexes.append( index )
-            else:
-                # Count up index 2 times ( Separator + next Name )
-                index += 2
-                parts.append( word )
-                parts.append( " " )
+        # We only need to work on names without wikilink
+        indexes = [ index for index in range( 0, len( parts ), 2 )
+                    if parts[index] and "[[" not in parts[index] ]
 
         # If we have indexes without links, search for links
         if indexes:
 
-            parts = self._search_links( parts, indexes )
+            if type( self ).link_index:
+                fallback = type( self ).link_index.get_interpret
+            else:
+                fallback = None
+
+            parts = self._search_links( parts, indexes, fallback )
 
-            # Join the collected links
-            sep = " "
-            self.interpret = sep.join( parts )
+            # Join the collected links, separators keep their whitespace
+            self.interpret = "".join( parts )
 
         # Nothing to do, just use raw
         else:
             self.interpret = self._interpret_raw
 
+    @classmethod
+    def split_credit( cls, credit ):
+        """
+        Splits artist credit into names and separators in a single pass.
+        Wikilinks and templates are kept intact, even if they contain
+        separators.
+
+        @param credit: Artist credit
+        @type credit: str
+        @returns  Names and normalized separators, alternating, starting and
+                  ending with a name
+        @rtype    list
+        """
+        parts = list()
+        name = list()
+        position = 0
+
+        for match in cls.credit_tokens.finditer( credit ):
+
+            # Separator ends current name
+            if match.group( 2 ):
+                name.append( credit[ position:match.start() ] )
+                parts.append( " ".join( "".join( name ).split() ) )
+
+                separator = match.group( 2 ).strip()
+                if separator == ",":
+                    parts.append( ", " )
+                else:
+                    parts.append( " " + separator + " " )
+
+                name = list()
+
+            # Links and templates belong to current name
+            else:
+                name.append( credit[ position:match.end() ] )
+
+            position = match.end()
+
+        name.append( credit[ position: ] )
+        parts.append( " ".join( "".join( name ).split() ) )
+
+        return parts
+
     def get_interpret_value( self ):
         """
         Reads value of Interpret parameter
@@ -405,7 +1010,7 @@ missing!" )
             raise CountryListEntryError( "Template Parameter 'Interpret' is \
 missing!" )
 
-    def _search_links( self, keywords, indexes=None ):
+    def _search_links( self, keywords, indexes=None, fallback=None ):
         """
         Search matching wikilinks for keyword(s) in CountryList's wikicode
 
@@ -414,6 +1019,9 @@ missing!" )
         @param indexes: List with numeric indexes for items of keywords to work
                         on only
         @type indexes: list of ints
+        @param fallback: Called with keyword if no wikilink was found in
+                         CountryList, returning wikilink or None
+        @type fallback: callable
         @return: List or String with replaced keywords
         @return type: str, list
         """
@@ -429,28 +1037,26 @@ missing!" )
         if not indexes:
             indexes = list(range( len( keywords ) ))
 
-        # Iterate over wikilinks of refpage and try to find related links
-        for wikilink in self.wikicode.ifilter_wikilinks():
+        with tracing.span( "Link search", "countrylist",
+                           keywords=len( indexes ) ):
+
+            # Map link texts and titles of refpage to wikilinks once
+            if self._page_links is None:
+                self.get_page_links()
 
             # Iterate over interpret names
             for index in indexes:
 
-                # Check wether wikilink matches
-                if( keywords[index] == wikilink.text or
-                    keywords[index] == wikilink.title ):
+                # Overwrite name with complete wikilink
+                if keywords[index] in self._page_links:
+                    keywords[index] = self._page_links[ keywords[index] ]
 
-                    # Overwrite name with complete wikilink
-                    keywords[index] = str( wikilink )
-
-                    # Remove index from worklist
-                    indexes.remove( index )
-
-                    # Other indexes won't also match
-                    break
+                elif fallback and fallback( keywords[index] ):
+                    keywords[index] = fallback( keywords[index] )
 
-            # If worklist is empty, stop iterating over wikilinks
-            if not indexes:
-                break
+                # Remember name for later lookup
+                else:
+                    self.unresolved.append( keywords[index] )
 
         # Choose wether return list or string based on input type
         if not string:
@@ -458,6 +1064,29 @@ missing!" )
         else:
             return str(keywords[0])
 
+    def get_page_links( self ):
+        """
+        Maps texts and titles of wikilinks in CountryList's wikicode to the
+        first wikilink they occur in
+        """
+        self._page_links = dict()
+
+        for wikilink in self.wikicode.ifilter_wikilinks():
+            for name in ( wikilink.text, wikilink.title ):
+                if name is not None:
+                    self._page_links.setdefault( str( name ), str( wikilink ) )
+
+    def index_links( self ):
+        """
+        Add links of all entries of CountryList to shared LinkIndex
+        """
+        if not type( self ).link_index:
+            return
+
+        for entry in self.wikicode.ifilter_templates(
+                matches="Nummer-eins-Hits Zeile" ):
+            type( self ).link_index.add_entry( entry )
+
     def __str__( self ):
         """
         Returns str repression for Object
@@ -476,6 +1105,44 @@ missing!" )
                 link=repr(self.wikilink))
 
 
+class OfflinePage():
+    """
+    Minimal stand-in for pywikibot.Page with given text, for parsing
+    CountryLists without access to wiki
+    """
+
+    site = None
+
+    def __init__( self, title, text, revid=0 ):
+        """
+        Constructor
+
+        @param title: Title of page
+        @type title: str
+        @param text: Wikitext of page
+        @type text: str
+        @param revid: Revision id of text
+        @type revid: int
+        """
+        self._title = title
+        self.text = text
+        self.latest_revision_id = revid
+
+    def title( self, asLink=False ):
+        """
+        Returns title of page, maybe as wikilink
+        """
+        if asLink:
+            return "[[" + self._title + "]]"
+        return self._title
+
+    def exists( self ):
+        """
+        Offline pages always exist
+        """
+        return True
+
+
 class CountryListError( Exception ):
     """
     Handles errors occuring in class CountryList
@@ -572,14 +1239,23 @@ def main(*args):
     # Process global arguments to determine desired site
     local_args = pywikibot.handle_args(args)
 
+    page = None
+    profile = None
+
     # Parse command line arguments
     for arg in local_args:
         if arg.startswith("-page:"):
             page = arg[ len("-page:"): ]
+        elif arg.startswith("-profile"):
+            profile = arg[len("-profile:"):] or "countrylist-profile.txt"
 
     # Call unittest-class
     test = CountryListUnitTest( page )
-    test.treat()
+
+    if profile:
+        profiling.Profiler( profile ).runcall( test.treat )
+    else:
+        test.treat()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  deadline.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides a time budget for a run, to stop starting new work in time to
+save what was done before the budget runs out
+
+Steps are measured and checked with the module functions measure() and
+allows(). If no Deadline is active, they do nothing.
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class Deadline():
+    """
+    Keeps track of remaining time and of the duration of work steps
+    """
+
+    # Currently active Deadline instance, used by module functions
+    active = None
+
+    # Seconds kept free for saving pages
+    reserve = 60
+
+    def __init__( self, seconds, reserve=None ):
+        """
+        Constructor
+
+        @param seconds: Time budget of run in seconds
+        @type seconds: float
+        @param reserve: Seconds to keep free for saving pages
+        @type reserve: float
+        """
+        self.end = time.monotonic() + seconds
+
+        if reserve is not None:
+            self.reserve = reserve
+
+        # Running mean of measured step durations
+        self.steps = 0
+        self.mean = 0.0
+
+    def activate( self ):
+        """
+        Make this instance the active one
+        """
+        type( self ).active = self
+
+    def deactivate( self ):
+        """
+        Stop checking deadline
+        """
+        if type( self ).active is self:
+            type( self ).active = None
+
+    def remaining( self ):
+        """
+        Returns seconds until deadline
+        """
+        return self.end - time.monotonic()
+
+    def allows( self, steps=1 ):
+        """
+        Checks wether given number of steps of mean duration fit into the
+        remaining time, keeping the reserve
+        """
+        return self.remaining() - self.reserve > steps * self.mean
+
+    @contextmanager
+    def measure( self ):
+        """
+        Measure duration of enclosed step
+        """
+        start = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self.steps += 1
+            self.mean += ( time.monotonic() - start - self.mean ) / self.steps
+
+
+def allows( steps=1 ):
+    """
+    Checks wether active Deadline, if any, leaves time for given steps
+    """
+    if Deadline.active:
+        return Deadline.active.allows( steps )
+
+    return True
+
+
+@contextmanager
+def measure():
+    """
+    Measure duration of enclosed step for active Deadline, if any
+    """
+    if Deadline.active:
+        with Deadline.active.measure():
+            yield
+    else:
+        yield
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  dump.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Parses CountryLists offline from a MediaWiki XML dump
+
+The dump (plain, .bz2, .gz or .xz) is read as a stream, only pages of
+CountryLists are kept in memory, one at a time. For each of them the results
+of parsing are written as one JSON record per line.
+
+The following parameters are supported:
+
+-dump:path        Path of XML dump, required
+
+-titles:file      Only parse CountryLists listed in file, one title per line.
+                  Append |text to give link text (e.g. for belgian lists
+                  "|Wallonien"). Default: all pages starting with
+                  "Liste der Nummer-eins-Hits in ", belgian lists for both
+                  regions
+
+-out:file         File to write results to (default: stdout)
+"""
+
+import bz2
+import gzip
+import json
+import lzma
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+import pywikibot
+import mwparserfromhell as mwparser
+
+from countrylist import CountryList, OfflinePage
+
+
+class DumpReader():
+    """
+    Streams pages out of a MediaWiki XML dump
+    """
+
+    # Opening functions by file extension
+    openers = { ".bz2": bz2.open, ".gz": gzip.open, ".xz": lzma.open }
+
+    def __init__( self, path, accept=None ):
+        """
+        Constructor
+
+        @param path: Path of dump
+        @type path: str
+        @param accept: Called with title of each page, only pages it returns
+                       True for are read
+        @type accept: callable
+        """
+        self.path = path
+        self.accept = accept
+
+        # Size of read pages in bytes
+        self.size = 0
+
+    def open( self ):
+        """
+        Returns binary file object of dump, decompressing if needed
+        """
+        for extension, opener in type( self ).openers.items():
+            if self.path.endswith( extension ):
+                return opener( self.path, "rb" )
+
+        return open( self.path, "rb" )
+
+    @staticmethod
+    def _local( tag ):
+        """
+        Returns tag name without XML namespace of dump schema version
+        """
+        return tag.rpartition( "}" )[2]
+
+    def __iter__( self ):
+        """
+        Yields OfflinePage for each accepted page with text of its latest
+        revision in dump
+        """
+        with self.open() as fd:
+            events = ElementTree.iterparse( fd, events=( "start", "end" ) )
+            _, root = next( events )
+
+            title = None
+            text = None
+            revid = 0
+
+            for event, element in events:
+                tag = type( self )._local( element.tag )
+
+                if event == "start":
+                    if tag == "page":
+                        title, text, revid = None, None, 0
+                    continue
+
+                if tag == "title" and title is None:
+                    title = element.text or ""
+
+                # Only the latest revision of page is kept
+                elif tag == "revision":
+                    for child in element:
+                        name = type( self )._local( child.tag )
+
+                        if name == "id":
+                            revid = int( child.text )
+                        elif name == "text":
+                            text = child.text or ""
+
+                    element.clear()
+
+                elif tag == "page":
+                    if( text is not None and
+                            ( not self.accept or self.accept( title ) ) ):
+                        self.size += len( text.encode( "utf-8" ) )
+                        yield OfflinePage( title, text, revid )
+
+                    # Drop parsed pages so memory usage stays constant
+                    root.clear()
+
+                # Skip texts of pages which are not accepted
+                elif tag == "text" and self.accept and not (
+                        title and self.accept( title ) ):
+                    element.clear()
+
+
+class DumpExtraction():
+    """
+    Parses CountryLists of a dump and writes their results
+    """
+
+    # Prefix of titles of CountryLists
+    prefix = "Liste der Nummer-eins-Hits in "
+
+    # Link texts selecting regions of belgian lists
+    belgian = ( "Wallonien", "Flandern" )
+
+    def __init__( self, path, titles=None ):
+        """
+        Constructor
+
+        @param path: Path of dump
+        @type path: str
+        @param titles: Titles of CountryLists to parse, maybe with link
+                       text separated by "|", all CountryLists if None
+        @type titles: iterable of str
+        """
+        # Title -> link texts to parse page with
+        if titles:
+            self.titles = dict()
+            for item in titles:
+                title, _, text = item.partition( "|" )
+                self.titles.setdefault( title.strip(), list() ).append(
+                    text.strip() or None )
+        else:
+            self.titles = None
+
+        self.reader = DumpReader( path, self.is_wanted )
+
+    def is_wanted( self, title ):
+        """
+        Checks wether page with given title needs to be parsed
+        """
+        if self.titles is not None:
+            return title in self.titles
+
+        return title.startswith( type( self ).prefix )
+
+    def get_link_texts( self, title ):
+        """
+        Returns link texts to parse page with given title with
+        """
+        if self.titles is not None:
+            return self.titles[ title ]
+        elif "Belgien" in title:
+            return type( self ).belgian
+
+        return ( None, )
+
+    def run( self, out ):
+        """
+        Parse all wanted pages and write one JSON record per result to out
+
+        @returns  Number of failed CountryLists
+        @rtype    int
+        """
+        start = time.perf_counter()
+        parsed = 0
+        failed = 0
+
+        for page in self.reader:
+            for text in self.get_link_texts( page.title() ):
+                record = { "title": page.title(), "text": text }
+
+                try:
+                    countrylist = CountryList(
+                        mwparser.nodes.Wikilink( page.title(), text ), page )
+                    countrylist.parse()
+                except Exception as error:
+                    # Broken lists must not stop extraction of others
+                    record["error"] = repr( error )
+                    failed += 1
+                else:
+                    record.update( countrylist.get_result() )
+
+                parsed += 1
+                out.write( json.dumps( record, ensure_ascii=False ) + "\n" )
+
+        elapsed = time.perf_counter() - start
+        pywikibot.output( ( "{parsed} CountryList(s) parsed, {failed} " +
+                            "failed, {mb:.1f} MiB of wanted pages in " +
+                            "{elapsed:.1f} s" ).format(
+            parsed=parsed, failed=failed, elapsed=elapsed,
+            mb=self.reader.size / 1024**2 ) )
+
+        return failed
+
+
+def main(*args):
+    """
+    Parse CountryLists from dump given by arguments
+    """
+    # Process global arguments to determine desired site
+    local_args = pywikibot.handle_args(args)
+
+    path = None
+    titles = None
+    out = None
+
+    # Parse command line arguments
+    for arg in local_args:
+        if arg.startswith("-dump:"):
+            path = arg[ len("-dump:"): ]
+        elif arg.startswith("-titles:"):
+            with open( arg[ len("-titles:"): ], encoding="utf-8" ) as fd:
+                titles = [ line for line in fd if line.strip() ]
+        elif arg.startswith("-out:"):
+            out = arg[ len("-out:"): ]
+
+    if not path:
+        pywikibot.showHelp()
+        return
+
+    extraction = DumpExtraction( path, titles )
+
+    if out:
+        with open( out, "w", encoding="utf-8" ) as fd:
+            failed = extraction.run( fd )
+    else:
+        failed = extraction.run( sys.stdout )
+
+    sys.exit( 1 if failed else 0 )
+
+
+if __name__ == "__main__":
+    main()
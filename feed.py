@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  feed.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides a machine readable feed of changed summary page entries
+
+Each change is one JSON record: summary page, country, chart category,
+CountryList with its revision and old and new Interpret, Titel and Chartein.
+Records are appended to a JSON lines file or, for targets "unix:path", sent
+to a local Unix socket.
+"""
+
+import json
+import socket
+from datetime import datetime
+
+import jogobot
+
+
+class ChangeFeed():
+    """
+    Writes changes of summary page entries to file or socket
+    """
+
+    # Prefix of targets naming a Unix socket
+    socket_prefix = "unix:"
+
+    # Seconds to wait for socket
+    timeout = 5
+
+    def __init__( self, target ):
+        """
+        Constructor
+
+        @param target: Path of file to append records to, or "unix:" and
+                       path of socket to send them to
+        @type target: str
+        """
+        self.target = target
+        self.count = 0
+
+    def emit( self, page, changes ):
+        """
+        Write records for changes of given summary page
+
+        @param page: Title of summary page
+        @type page: str
+        @param changes: Changes as returned by SummaryPage.get_changes()
+        @type changes: list
+        """
+        if not changes:
+            return
+
+        timestamp = datetime.utcnow().strftime( "%Y-%m-%dT%H:%M:%SZ" )
+        data = "".join( json.dumps( dict( change, page=page,
+                                          timestamp=timestamp ),
+                                    ensure_ascii=False ) + "\n"
+                        for change in changes )
+
+        # Consumers not listening must not break the run
+        try:
+            if self.target.startswith( type( self ).socket_prefix ):
+                self.send( data )
+            else:
+                with open( self.target, "a", encoding="utf-8" ) as fd:
+                    fd.write( data )
+        except OSError as error:
+            jogobot.output( "Change feed not written: {error}".format(
+                error=repr( error ) ), "WARNING" )
+            return
+
+        self.count += len( changes )
+
+    def send( self, data ):
+        """
+        Send data to Unix socket of target
+        """
+        with socket.socket( socket.AF_UNIX, socket.SOCK_STREAM ) as sock:
+            sock.settimeout( type( self ).timeout )
+            sock.connect( self.target[ len( type( self ).socket_prefix ): ] )
+            sock.sendall( data.encode( "utf-8" ) )
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  httpcache.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides a persistent local cache of API responses, used as hook around
+pywikibot API requests
+
+Responses which can not change (revisions requested by revid, parsed or
+compared old revisions) are cached by request, siteinfo for a day. Requests
+for the current text of pages are revalidated: only revision ids are
+requested from the wiki and the text is taken from cache if all revisions
+are known, otherwise the full request is sent and its texts are stored.
+"""
+
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+
+from pywikibot.data import api
+
+import apihooks
+import metrics
+
+
+class ResponseCache():
+    """
+    Caches API responses in a SQLite file with a size limit, evicting least
+    recently used entries
+    """
+
+    # Default size limit in bytes
+    max_size = 256 * 1024**2
+
+    # Seconds siteinfo is reused
+    siteinfo_ttl = 24 * 3600
+
+    # Keys of revisions holding content, stored by revid
+    content_keys = ( "*", "content", "contentformat", "contentmodel",
+                     "texthidden", "slots" )
+
+    # Params selecting other revisions than the latest one
+    history_params = ( "rvlimit", "rvstart", "rvend", "rvstartid",
+                       "rvendid", "rvdir", "rvuser", "rvexcludeuser" )
+
+    def __init__( self, path, max_size=None, bypass=False ):
+        """
+        Constructor
+
+        @param path: SQLite file to store responses in
+        @type path: str
+        @param max_size: Size limit of stored responses in bytes
+        @type max_size: int
+        @param bypass: Send all requests to wiki, only storing responses
+        @type bypass: bool
+        """
+        self.path = path
+        self.bypass = bypass
+
+        if max_size:
+            self.max_size = max_size
+
+        self.db = None
+        self.size = 0
+
+        # Requests may be sent from multiple threads
+        self.lock = threading.Lock()
+
+    def open( self ):
+        """
+        Open database, creating table if needed
+        """
+        self.db = sqlite3.connect( self.path, check_same_thread=False )
+        self.db.execute( "CREATE TABLE IF NOT EXISTS responses ( " +
+                         "key TEXT PRIMARY KEY, data TEXT, size INTEGER, " +
+                         "expires REAL, accessed REAL )" )
+        self.db.execute( "CREATE INDEX IF NOT EXISTS responses_accessed " +
+                         "ON responses ( accessed )" )
+        self.db.commit()
+
+        self.size = self.db.execute(
+            "SELECT COALESCE( SUM( size ), 0 ) FROM responses" ).fetchone()[0]
+
+    def close( self ):
+        """
+        Close database
+        """
+        if self.db:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def activate( self ):
+        """
+        Open database and start caching API requests
+        """
+        self.open()
+        apihooks.add( self.cache_request )
+
+    def deactivate( self ):
+        """
+        Stop caching and close database
+        """
+        apihooks.remove( self.cache_request )
+        self.close()
+
+    def get( self, key ):
+        """
+        Returns unexpired cached value for key or None
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data, expires FROM responses WHERE key = ?",
+                ( key, ) ).fetchone()
+
+            if not row:
+                return None
+
+            if row[1] is not None and row[1] < time.time():
+                return None
+
+            self.db.execute( "UPDATE responses SET accessed = ? " +
+                             "WHERE key = ?", ( time.time(), key ) )
+
+        return json.loads( row[0] )
+
+    def put( self, key, value, ttl=math.inf ):
+        """
+        Store value for key for ttl seconds, evicting least recently used
+        entries if cache grows over size limit
+        """
+        data = json.dumps( value, ensure_ascii=False )
+        expires = None if ttl == math.inf else time.time() + ttl
+
+        with self.lock:
+            row = self.db.execute( "SELECT size FROM responses WHERE key = ?",
+                                   ( key, ) ).fetchone()
+            if row:
+                self.size -= row[0]
+
+            self.db.execute( "INSERT OR REPLACE INTO responses VALUES " +
+                             "( ?, ?, ?, ?, ? )", ( key, data, len( data ),
+                                                    expires, time.time() ) )
+            self.size += len( data )
+
+            if self.size > self.max_size:
+                self._evict()
+
+            self.db.commit()
+
+    def _evict( self ):
+        """
+        Delete least recently used entries until size limit is met
+        """
+        rows = self.db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed" ).fetchall()
+
+        for key, size in rows:
+
+            if self.size <= self.max_size:
+                break
+
+            self.db.execute( "DELETE FROM responses WHERE key = ?", ( key, ) )
+            self.size -= size
+
+    @staticmethod
+    def get_params( request ):
+        """
+        Returns params of request as dict of strings
+        """
+        return { key: "|".join( str( item ) for item in value )
+                 if isinstance( value, list ) else str( value )
+                 for key, value in getattr( request, "_params",
+                                            dict() ).items() }
+
+    @staticmethod
+    def get_key( site, params ):
+        """
+        Returns cache key for request with params to site
+        """
+        return "request:" + hashlib.sha1( json.dumps(
+            [ str( site ), sorted( params.items() ) ],
+            ensure_ascii=False ).encode( "utf-8" ) ).hexdigest()
+
+    @staticmethod
+    def get_revision_key( site, revid ):
+        """
+        Returns cache key for content of revision
+        """
+        return "revision:{site}:{revid}".format( site=site, revid=revid )
+
+    def get_lifetime( self, params ):
+        """
+        Returns seconds response to request with params can be reused, None
+        if it must not be cached by request
+        """
+        action = params.get( "action" )
+
+        # Old revisions never change
+        if( action == "query" and params.get( "revids" ) and
+                params.get( "prop" ) == "revisions" ):
+            return math.inf
+        elif action == "parse" and params.get( "oldid" ):
+            return math.inf
+        elif( action == "compare" and params.get( "fromrev" ) and
+              params.get( "torev" ) ):
+            return math.inf
+
+        elif( action == "query" and params.get( "meta" ) == "siteinfo" and
+              "prop" not in params and "titles" not in params ):
+            return type( self ).siteinfo_ttl
+
+        return None
+
+    def is_content_query( self, params ):
+        """
+        Checks wether params request content of latest revisions of pages
+        """
+        return ( params.get( "action" ) == "query" and
+                 "revisions" in params.get( "prop", "" ).split( "|" ) and
+                 "content" in params.get( "rvprop", "" ).split( "|" ) and
+                 not any( key in params
+                          for key in type( self ).history_params ) )
+
+    def cache_request( self, request, submit ):
+        """
+        API hook answering requests from cache where possible
+        """
+        params = type( self ).get_params( request )
+        ttl = self.get_lifetime( params )
+
+        if ttl is not None:
+            key = type( self ).get_key( request.site, params )
+
+            if not self.bypass:
+                data = self.get( key )
+
+                if data is not None:
+                    metrics.inc( "http_cache", result="hit" )
+                    return data
+
+            metrics.inc( "http_cache", result="miss" )
+            data = submit()
+
+            if "error" not in data:
+                self.put( key, data, ttl )
+
+            return data
+
+        elif self.is_content_query( params ):
+            return self.revalidate( request, params, submit )
+
+        return submit()
+
+    def revalidate( self, request, params, submit ):
+        """
+        Answer request for content of latest revisions from cache if only
+        revision ids have changed since they were stored
+        """
+        if not self.bypass:
+            rvprop = [ prop for prop in params["rvprop"].split( "|" )
+                       if prop != "content" ]
+            if "ids" not in rvprop:
+                rvprop.append( "ids" )
+
+            # Send cheap request through the inner hooks only, not through
+            # this cache again
+            cheap = dict( params, rvprop="|".join( rvprop ) )
+            data = submit( api.Request( site=request.site,
+                                        parameters=cheap ) )
+
+            # Continuation of cheap request may differ from full one
+            if( "continue" not in data and "query-continue" not in data and
+                    self.inject_content( request.site, data ) ):
+                metrics.inc( "http_cache", result="revalidated" )
+                return data
+
+        metrics.inc( "http_cache", result="miss" )
+        data = submit()
+        self.store_content( request.site, data )
+
+        return data
+
+    @staticmethod
+    def get_revisions( data ):
+        """
+        Returns revisions of all pages in query response
+        """
+        pages = data.get( "query", dict() ).get( "pages", list() )
+
+        if isinstance( pages, dict ):
+            pages = pages.values()
+
+        return [ revision for page in pages
+                 for revision in page.get( "revisions", list() ) ]
+
+    def inject_content( self, site, data ):
+        """
+        Add cached content to revisions in response
+
+        @returns  False if content of any revision is not cached
+        @rtype    bool
+        """
+        revisions = type( self ).get_revisions( data )
+        contents = list()
+
+        for revision in revisions:
+            content = self.get( type( self ).get_revision_key(
+                site, revision.get( "revid" ) ) )
+
+            if content is None:
+                return False
+
+            contents.append( content )
+
+        if not revisions:
+            return False
+
+        for revision, content in zip( revisions, contents ):
+            revision.update( content )
+
+        return True
+
+    def store_content( self, site, data ):
+        """
+        Store content of revisions in response by revid
+        """
+        for revision in type( self ).get_revisions( data ):
+            content = { key: revision[key]
+                        for key in type( self ).content_keys
+                        if key in revision }
+
+            if "revid" in revision and content:
+                self.put( type( self ).get_revision_key(
+                    site, revision["revid"] ), content )
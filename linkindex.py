@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  linkindex.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides an index of artist and song names to wikilinks, shared by all
+CountryLists of a run and optionally stored between runs
+"""
+
+import json
+import os
+import re
+import time
+
+import mwparserfromhell as mwparser
+
+
+class LinkIndex():
+    """
+    Maps artist names, and song names per artist, to wikilinks found in
+    the entries of parsed CountryLists
+
+    Names linked to different targets are marked ambiguous and not resolved.
+    Entries found in this run replace those of earlier runs, which are only
+    used as fallback until they were not seen again for ttl seconds. So
+    moved articles and names no longer ambiguous are picked up again.
+    """
+
+    # Seconds entries of earlier runs are kept without being seen again
+    ttl = 7 * 24 * 3600
+
+    def __init__( self, path=None ):
+        """
+        Constructor
+
+        @param path: If given, index is loaded from and saved to this file
+        @type path: str
+        """
+        self.path = path
+
+        # Name -> wikilink, None for ambiguous names
+        self.interpret = dict()
+
+        # Artist key + "\n" + title -> wikilink, None for ambiguous titles
+        self.titel = dict()
+
+        # Entries of earlier runs per kind, key -> [ wikilink, last seen ]
+        self.stored = { "interpret": dict(), "titel": dict() }
+
+        if self.path and os.path.exists( self.path ):
+            with open( self.path, encoding="utf-8" ) as fd:
+                data = json.load( fd )
+
+            # Entries of files without timestamps are dropped
+            expired = time.time() - type( self ).ttl
+            for kind in self.stored:
+                self.stored[ kind ] = {
+                    key: entry for key, entry in data.get(
+                        kind, dict() ).items()
+                    if isinstance( entry, list ) and entry[1] > expired }
+
+    def save( self ):
+        """
+        Write index to file, if path was given
+        """
+        if not self.path:
+            return
+
+        now = time.time()
+        data = dict()
+        for kind in self.stored:
+            data[ kind ] = dict( self.stored[ kind ] )
+            data[ kind ].update( ( key, [ wikilink, now ] ) for key, wikilink
+                                 in getattr( self, kind ).items() )
+
+        # Write to temporary file first to never leave a broken index
+        with open( self.path + ".tmp", "w", encoding="utf-8" ) as fd:
+            json.dump( data, fd, ensure_ascii=False )
+
+        os.replace( self.path + ".tmp", self.path )
+
+    # Separators of artist names in credits
+    separators = re.compile(
+        r"\s+(?:feat\.|ft\.|&|x|und|vs\.|with)\s+|\s*,\s*" )
+
+    @classmethod
+    def artist_key( cls, interpret ):
+        """
+        Returns key for artist credit used to look up titles, which is the
+        plain name of the first artist, whether linked or not
+
+        @param interpret: Value of Interpret param
+        @type interpret: str, mwparser.wikicode.Wikicode
+        @rtype    str
+        """
+        if isinstance( interpret, str ):
+            interpret = mwparser.parse( interpret )
+
+        return cls.separators.split( interpret.strip_code().strip() )[0]
+
+    def _add( self, mapping, key, wikilink ):
+        """
+        Add wikilink for key, marking key ambiguous on differing targets
+        """
+        if key not in mapping:
+            mapping[ key ] = str( wikilink )
+
+        elif mapping[ key ] is not None:
+            target = mwparser.parse( mapping[ key ] ).filter_wikilinks()[0]
+            if( str( target.title ).strip() !=
+                str( wikilink.title ).strip() ):
+                mapping[ key ] = None
+
+    def add_entry( self, entry ):
+        """
+        Add the links of Interpret and Titel of a CountryList entry template
+
+        @param entry: "Nummer-eins-Hits Zeile" template
+        @type entry: mwparser.nodes.template.Template
+        """
+        if entry.has( "Interpret" ):
+            interpret = entry.get( "Interpret" ).value
+
+            for wikilink in interpret.ifilter_wikilinks():
+                for name in ( wikilink.text, wikilink.title ):
+                    if name is not None and str( name ).strip():
+                        self._add( self.interpret, str( name ).strip(),
+                                   wikilink )
+
+            artist = type( self ).artist_key( interpret )
+
+            # Without artist (e.g. only SortKeyName) titles can't be keyed
+            if entry.has( "Titel" ) and artist:
+                for wikilink in entry.get( "Titel" ).value.ifilter_wikilinks():
+                    for name in ( wikilink.text, wikilink.title ):
+                        if name is not None and str( name ).strip():
+                            self._add( self.titel, artist + "\n" +
+                                       str( name ).strip(), wikilink )
+
+    def get_interpret( self, name ):
+        """
+        Returns wikilink for artist name or None if unknown or ambiguous
+        """
+        if name in self.interpret:
+            return self.interpret[ name ]
+
+        return self.stored[ "interpret" ].get( name, ( None, ) )[0]
+
+    def get_titel( self, artist, name ):
+        """
+        Returns wikilink for song name of artist or None if unknown or
+        ambiguous
+
+        @param artist: Key for artist as returned by artist_key()
+        @type artist: str
+        """
+        key = artist + "\n" + name
+
+        if key in self.titel:
+            return self.titel[ key ]
+
+        return self.stored[ "titel" ].get( key, ( None, ) )[0]
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  linkresolver.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides a class for checking names and link targets of summary page entries
+against the wiki in batched queries
+"""
+
+import json
+import os
+import re
+import time
+
+import pywikibot
+from pywikibot.data import api
+import mwparserfromhell as mwparser
+
+import jogobot
+
+import metrics
+
+
+class LinkResolver():
+    """
+    Looks up existence, redirect targets and disambiguation state of titles
+    in batched queries and caches results for a while
+
+    Unlinked names are linked if a matching article exists, links to redirects
+    are bypassed and links to disambiguation pages are removed.
+    """
+
+    # Seconds a cached result is valid
+    ttl = 7 * 24 * 3600
+
+    # Maximal number of titles per query
+    batchsize = 50
+
+    def __init__( self, site, path=None ):
+        """
+        Constructor
+
+        @param site: Site to query
+        @type site: pywikibot.site.APISite
+        @param path: If given, cache is loaded from and saved to this file
+        @type path: str
+        """
+        self.site = site
+        self.path = path
+
+        # Title -> { "exists", "target", "disambiguation", "time" }
+        self.cache = dict()
+
+        if self.path and os.path.exists( self.path ):
+            with open( self.path, encoding="utf-8" ) as fd:
+                self.cache = json.load( fd )
+
+    def save( self ):
+        """
+        Write unexpired cache entries to file, if path was given
+        """
+        if not self.path:
+            return
+
+        self.cache = { title: info for title, info in self.cache.items()
+                       if not self._expired( info ) }
+
+        with open( self.path + ".tmp", "w", encoding="utf-8" ) as fd:
+            json.dump( self.cache, fd, ensure_ascii=False )
+
+        os.replace( self.path + ".tmp", self.path )
+
+    def _expired( self, info ):
+        """
+        Checks wether cached info is older than ttl
+        """
+        return info["time"] + type( self ).ttl < time.time()
+
+    def query( self, titles ):
+        """
+        Look up given titles which are not cached yet
+
+        @param titles: Titles to look up
+        @type titles: iterable of str
+        """
+        titles = { title for title in titles if title }
+        missing = sorted( title for title in titles if
+                          title not in self.cache or
+                          self._expired( self.cache[title] ) )
+
+        metrics.inc( "link_cache", len( titles ) - len( missing ),
+                     result="hit" )
+        metrics.inc( "link_cache", len( missing ), result="miss" )
+
+        for start in range( 0, len( missing ), type( self ).batchsize ):
+            self._query_batch(
+                missing[ start:start + type( self ).batchsize ] )
+
+    def _query_batch( self, titles ):
+        """
+        Look up given titles in a single request
+        """
+        request = api.Request( site=self.site, parameters={
+            "action": "query",
+            "titles": "|".join( titles ),
+            "redirects": True,
+            "prop": "pageprops",
+            "ppprop": "disambiguation" } )
+
+        try:
+            data = request.submit().get( "query", dict() )
+        except pywikibot.Error as error:
+            jogobot.output( "Link lookup failed: {error}".format(
+                error=repr( error ) ), "WARNING" )
+            return
+
+        normalized = { item["from"]: item["to"]
+                       for item in data.get( "normalized", list() ) }
+        redirects = { item["from"]: item for item in
+                      data.get( "redirects", list() ) }
+
+        pages = data.get( "pages", dict() )
+        if isinstance( pages, dict ):
+            pages = pages.values()
+        pages = { page["title"]: page for page in pages }
+
+        now = time.time()
+
+        for title in titles:
+            resolved = normalized.get( title, title )
+            target = None
+
+            if resolved in redirects:
+                redirect = redirects[ resolved ]
+                resolved = target = redirect["to"]
+
+                if redirect.get( "tofragment" ):
+                    target += "#" + redirect["tofragment"]
+
+            page = pages.get( resolved, dict() )
+
+            self.cache[ title ] = {
+                "exists": bool( page ) and "missing" not in page and
+                "invalid" not in page,
+                "target": target,
+                "disambiguation": "disambiguation" in page.get(
+                    "pageprops", dict() ),
+                "time": now }
+
+    def get( self, title ):
+        """
+        Returns cached info for title or None
+        """
+        return self.cache.get( title )
+
+    def resolve( self, value, names=() ):
+        """
+        Apply looked up info to wikilinks and unlinked names in value
+
+        @param value: Value of Interpret or Titel param
+        @type value: str, mwparser.wikicode.Wikicode
+        @param names: Names occurring unlinked in value
+        @type names: iterable of str
+
+        @returns  Resolved value
+        @rtype    str
+        """
+        wikicode = mwparser.parse( str( value ) )
+
+        for wikilink in wikicode.filter_wikilinks():
+            info = self.get( str( wikilink.title ).strip() )
+
+            if not info or not info["exists"]:
+                continue
+
+            # Links to disambiguation pages are no help, keep only text
+            if info["disambiguation"]:
+                wikicode.replace( wikilink, wikilink.text if
+                                  wikilink.text is not None else
+                                  wikilink.title )
+
+            # Bypass redirects
+            elif info["target"]:
+                if wikilink.text is None:
+                    wikilink.text = str( wikilink.title ).strip()
+                wikilink.title = info["target"]
+
+        for name in names:
+            info = self.get( name )
+
+            if( not info or not info["exists"] or info["disambiguation"] ):
+                continue
+
+            if info["target"]:
+                link = "[[{target}|{name}]]".format( target=info["target"],
+                                                     name=name )
+            else:
+                link = "[[{name}]]".format( name=name )
+
+            # Only replace name in plain text, not within links or templates
+            pattern = re.compile( r"(?<!\w)" + re.escape( name ) + r"(?!\w)" )
+            for text in wikicode.filter_text( recursive=False ):
+                if pattern.search( str( text ) ):
+                    text.value = pattern.sub( lambda match: link,
+                                              str( text ), count=1 )
+                    break
+
+        return str( wikicode )
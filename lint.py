@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  lint.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Checks many CountryLists at once for errors in parsing, to find broken lists
+before they break the run over summary pages
+
+Pages are fetched in batches in a background thread while previously fetched
+pages are parsed in parallel worker processes. Lists raising errors and
+throughput figures are reported.
+
+The following parameters are supported:
+
+&params;
+
+-workers:n        Number of parsing processes (default: number of CPUs)
+
+-groupsize:n      Number of pages fetched per request (default: 50)
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pywikibot
+from pywikibot import pagegenerators
+import mwparserfromhell as mwparser
+
+from countrylist import CountryList, CountryListError, OfflinePage
+
+
+def lint_page( title, text, revid ):
+    """
+    Parse given CountryList text, run in worker process
+
+    @returns  Title, parse time in seconds, error class name and message or
+              None for both if parsing succeeded
+    @rtype    tuple
+    """
+    start = time.perf_counter()
+
+    try:
+        CountryList( mwparser.nodes.Wikilink( title ),
+                     OfflinePage( title, text, revid ) ).parse()
+    except CountryListError as error:
+        kind, message = type( error ).__name__, str( error )
+    except Exception as error:
+        # Unexpected errors would crash the summary run, report them too
+        kind, message = type( error ).__name__, repr( error )
+    else:
+        kind, message = None, None
+
+    return title, time.perf_counter() - start, kind, message
+
+
+class BulkLint():
+    """
+    Fetches pages of generator and parses them as CountryLists in parallel
+    """
+
+    # Sentinel put into queue after last page
+    _done = object()
+
+    def __init__( self, generator, workers=None, groupsize=50 ):
+        """
+        Constructor
+
+        @param generator: Generator of CountryList pages
+        @type generator: generator
+        @param workers: Number of parsing processes, number of CPUs if None
+        @type workers: int
+        @param groupsize: Number of pages fetched per request
+        @type groupsize: int
+        """
+        self.generator = generator
+        self.workers = workers or os.cpu_count() or 1
+        self.groupsize = groupsize
+
+        # Fetched pages waiting for parsing, bounded to limit memory usage
+        self.queue = queue.Queue( maxsize=2 * groupsize )
+
+        self.fetched_bytes = 0
+        self.skipped = list()
+        self.failed = list()
+        self.parsed = 0
+        self.parse_time = 0.0
+
+    def fetch( self ):
+        """
+        Load pages in batches and put title, text and revid into queue, run
+        in background thread
+        """
+        try:
+            for page in pagegenerators.PreloadingGenerator(
+                    self.generator, self.groupsize ):
+                try:
+                    if page.isRedirectPage():
+                        raise pywikibot.IsRedirectPage( page )
+
+                    text = page.get()
+                except pywikibot.Error as error:
+                    self.skipped.append( ( page.title(), repr( error ) ) )
+                    continue
+
+                self.fetched_bytes += len( text.encode( "utf-8" ) )
+                self.queue.put( ( page.title(), text,
+                                  page.latest_revision_id ) )
+        finally:
+            self.queue.put( type( self )._done )
+
+    def collect( self, futures ):
+        """
+        Record results of finished parsing jobs
+
+        @returns  Unfinished jobs
+        @rtype    set
+        """
+        done, pending = wait( futures, return_when=FIRST_COMPLETED )
+
+        for future in done:
+            title, seconds, kind, message = future.result()
+
+            self.parsed += 1
+            self.parse_time += seconds
+
+            if kind:
+                self.failed.append( ( title, kind, message ) )
+                print( "FAIL  {title}: {kind}: {message}".format(
+                    title=title, kind=kind, message=message ) )
+
+        return pending
+
+    def run( self ):
+        """
+        Check all pages and report results
+
+        @returns  Number of failed lists
+        @rtype    int
+        """
+        start = time.perf_counter()
+
+        fetcher = threading.Thread( target=self.fetch, daemon=True )
+        fetcher.start()
+
+        futures = set()
+
+        with ProcessPoolExecutor( self.workers ) as executor:
+            while True:
+                item = self.queue.get()
+
+                if item is type( self )._done:
+                    break
+
+                futures.add( executor.submit( lint_page, *item ) )
+
+                # Do not let jobs pile up faster than they are parsed
+                if len( futures ) >= 4 * self.workers:
+                    futures = self.collect( futures )
+
+            while futures:
+                futures = self.collect( futures )
+
+        fetcher.join()
+
+        self.report( time.perf_counter() - start )
+
+        return len( self.failed )
+
+    def report( self, elapsed ):
+        """
+        Print skipped pages and throughput figures
+        """
+        for title, error in self.skipped:
+            print( "SKIP  {title}: {error}".format( title=title,
+                                                   error=error ) )
+
+        print( ( "{parsed} list(s) checked, {failed} failed, {skipped} " +
+                 "skipped in {elapsed:.1f} s" ).format(
+            parsed=self.parsed, failed=len( self.failed ),
+            skipped=len( self.skipped ), elapsed=elapsed ) )
+
+        if not self.parsed or not elapsed:
+            return
+
+        print( ( "{rate:.1f} list(s)/s, {mb:.2f} MiB fetched " +
+                 "({mbrate:.2f} MiB/s), {mean:.1f} ms mean parse time " +
+                 "with {workers} worker(s)" ).format(
+            rate=self.parsed / elapsed,
+            mb=self.fetched_bytes / 1024**2,
+            mbrate=self.fetched_bytes / 1024**2 / elapsed,
+            mean=self.parse_time / self.parsed * 1000,
+            workers=self.workers ) )
+
+
+def main(*args):
+    """
+    Check CountryLists given by page generator arguments
+    """
+    # Process global arguments to determine desired site
+    local_args = pywikibot.handle_args(args)
+
+    genFactory = pagegenerators.GeneratorFactory()
+    workers = None
+    groupsize = 50
+
+    # Parse command line arguments
+    for arg in local_args:
+        if arg.startswith("-workers:"):
+            workers = int( arg[ len("-workers:"): ] )
+        elif arg.startswith("-groupsize:"):
+            groupsize = int( arg[ len("-groupsize:"): ] )
+        else:
+            genFactory.handleArg(arg)
+
+    gen = genFactory.getCombinedGenerator()
+
+    if not gen:
+        pywikibot.showHelp()
+        return
+
+    sys.exit( 1 if BulkLint( gen, workers, groupsize ).run() else 0 )
+
+
+if __name__ == "__main__":
+    main()
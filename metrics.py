@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  metrics.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides collection and export of run metrics (counters, gauges and latency
+histograms) as Prometheus textfile or JSON
+
+Metrics are recorded with the module functions inc(), gauge() and timer() at
+the relevant places in the code. If no Metrics instance is active, they do
+nothing.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import apihooks
+
+
+class Metrics():
+    """
+    Collects metrics of a run and writes them to a file
+    """
+
+    # Currently active Metrics instance, used by module functions
+    active = None
+
+    # Upper bounds of histogram buckets in seconds
+    buckets = ( 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60 )
+
+    # Prefix of all metric names
+    prefix = "charts_"
+
+    def __init__( self, path ):
+        """
+        Constructor
+
+        @param path: File to write metrics to, Prometheus textfile format if
+                     it ends with .prom, JSON otherwise
+        @type path: str
+        """
+        self.path = path
+
+        # Name -> { labels -> value }
+        self.counters = OrderedDict()
+        self.gauges = OrderedDict()
+
+        # Name -> { labels -> [ bucket counts, sum, count ] }
+        self.histograms = OrderedDict()
+
+    def activate( self ):
+        """
+        Make this instance the active one and start counting API requests
+        """
+        type( self ).active = self
+        apihooks.add( self.time_request )
+
+    def deactivate( self ):
+        """
+        Stop collecting metrics
+        """
+        apihooks.remove( self.time_request )
+
+        if type( self ).active is self:
+            type( self ).active = None
+
+    def time_request( self, request, submit ):
+        """
+        API hook counting and timing requests per action
+        """
+        with timer( "api_request_duration_seconds",
+                    action=apihooks.get_action( request ) ):
+            return submit()
+
+    @staticmethod
+    def _labels( labels ):
+        """
+        Returns hashable, sorted representation of labels
+        """
+        return tuple( sorted( ( key, str( value ) )
+                              for key, value in labels.items() ) )
+
+    def inc( self, name, value=1, **labels ):
+        """
+        Increase counter name with given labels by value
+        """
+        counter = self.counters.setdefault( name, OrderedDict() )
+        key = type( self )._labels( labels )
+        counter[ key ] = counter.get( key, 0 ) + value
+
+    def set( self, name, value, **labels ):
+        """
+        Set gauge name with given labels to value
+        """
+        self.gauges.setdefault( name, OrderedDict() )[
+            type( self )._labels( labels ) ] = value
+
+    def observe( self, name, value, **labels ):
+        """
+        Add observed value to histogram name with given labels
+        """
+        histogram = self.histograms.setdefault( name, OrderedDict() )
+        key = type( self )._labels( labels )
+
+        if key not in histogram:
+            histogram[ key ] = [ [ 0 ] * len( type( self ).buckets ), 0.0, 0 ]
+
+        for index, bound in enumerate( type( self ).buckets ):
+            if value <= bound:
+                histogram[ key ][0][ index ] += 1
+
+        histogram[ key ][1] += value
+        histogram[ key ][2] += 1
+
+    def write( self ):
+        """
+        Write collected metrics to file, atomically so readers never see a
+        partial file
+        """
+        if self.path.endswith( ".prom" ):
+            content = self.format_prometheus()
+        else:
+            content = self.format_json()
+
+        with open( self.path + ".tmp", "w", encoding="utf-8" ) as fd:
+            fd.write( content )
+
+        os.replace( self.path + ".tmp", self.path )
+
+    @staticmethod
+    def _format_labels( labels, extra=() ):
+        """
+        Returns labels in Prometheus notation
+        """
+        labels = tuple( labels ) + tuple( extra )
+
+        if not labels:
+            return ""
+
+        return "{" + ",".join(
+            '{key}="{value}"'.format( key=key, value=value.replace(
+                "\\", "\\\\" ).replace( '"', '\\"' ).replace( "\n", "\\n" ) )
+            for key, value in labels ) + "}"
+
+    def format_prometheus( self ):
+        """
+        Returns collected metrics in Prometheus textfile format
+        """
+        lines = list()
+
+        def add( name, labels, value, extra=() ):
+            lines.append( "{prefix}{name}{labels} {value}".format(
+                prefix=type( self ).prefix, name=name, value=value,
+                labels=type( self )._format_labels( labels, extra ) ) )
+
+        def add_type( name, kind ):
+            lines.append( "# TYPE {prefix}{name} {kind}".format(
+                prefix=type( self ).prefix, name=name, kind=kind ) )
+
+        for name, values in self.counters.items():
+            add_type( name + "_total", "counter" )
+            for labels, value in values.items():
+                add( name + "_total", labels, value )
+
+        for name, values in self.gauges.items():
+            add_type( name, "gauge" )
+            for labels, value in values.items():
+                add( name, labels, value )
+
+        for name, values in self.histograms.items():
+            add_type( name, "histogram" )
+            for labels, ( counts, total, count ) in values.items():
+                for bound, bucket in zip( type( self ).buckets, counts ):
+                    add( name + "_bucket", labels, bucket,
+                         ( ( "le", str( bound ) ), ) )
+                add( name + "_bucket", labels, count, ( ( "le", "+Inf" ), ) )
+                add( name + "_sum", labels, total )
+                add( name + "_count", labels, count )
+
+        return "\n".join( lines ) + "\n"
+
+    def format_json( self ):
+        """
+        Returns collected metrics as JSON
+        """
+        data = { "timestamp": time.time(),
+                 "buckets": type( self ).buckets,
+                 "counters": dict(),
+                 "gauges": dict(),
+                 "histograms": dict() }
+
+        for kind in ( "counters", "gauges" ):
+            for name, values in getattr( self, kind ).items():
+                data[kind][name] = [ { "labels": dict( labels ),
+                                       "value": value }
+                                     for labels, value in values.items() ]
+
+        for name, values in self.histograms.items():
+            data["histograms"][name] = [ { "labels": dict( labels ),
+                                           "buckets": counts,
+                                           "sum": total,
+                                           "count": count }
+                                         for labels, ( counts, total, count )
+                                         in values.items() ]
+
+        return json.dumps( data, indent=4, ensure_ascii=False )
+
+
+def inc( name, value=1, **labels ):
+    """
+    Increase counter of active Metrics instance, if any
+    """
+    if Metrics.active:
+        Metrics.active.inc( name, value, **labels )
+
+
+def gauge( name, value, **labels ):
+    """
+    Set gauge of active Metrics instance, if any
+    """
+    if Metrics.active:
+        Metrics.active.set( name, value, **labels )
+
+
+@contextmanager
+def timer( name, **labels ):
+    """
+    Measure duration of enclosed code into histogram of active Metrics
+    instance, if any. Exceptions are counted by type in counter errors.
+    """
+    if not Metrics.active:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    except Exception as error:
+        # Count error only in innermost timer
+        if not getattr( error, "_metrics_counted", False ):
+            inc( "errors", type=type( error ).__name__ )
+            try:
+                error._metrics_counted = True
+            except AttributeError:
+                pass
+        raise
+    finally:
+        if Metrics.active:
+            Metrics.active.observe( name, time.perf_counter() - start,
+                                    **labels )
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  profiling.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides a profiler for bot runs using cProfile and tracemalloc
+
+Results are grouped in sections (e.g. per summary page and per CountryList)
+which are opened with section() at the relevant places in the code. If no
+Profiler is active, section() does nothing.
+"""
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import jogobot
+
+
+class Profiler():
+    """
+    Runs a callable under cProfile and tracemalloc and writes a report with
+    hot functions and largest allocations per section
+    """
+
+    # Currently active Profiler instance, used by module function section()
+    active = None
+
+    def __init__( self, filename, limit=25, frames=15 ):
+        """
+        Constructor
+
+        @param filename: Path of file to write report to
+        @type filename: str
+        @param limit: Number of functions/allocations listed per section
+        @type limit: int
+        @param frames: Number of frames stored per allocation traceback
+        @type frames: int
+        """
+        self.filename = filename
+        self.limit = limit
+        self.frames = frames
+
+        # Collected sections, keyed by label
+        self.sections = OrderedDict()
+
+        # Stack of currently open sections
+        self._stack = list()
+
+        # Time spent in profiler itself, not accounted to sections
+        self._overhead = 0.0
+
+    def runcall( self, func, *args, **kwargs ):
+        """
+        Call func with given args while profiling and write report afterwards
+
+        @returns  Return value of func
+        """
+        type( self ).active = self
+        tracemalloc.start( self.frames )
+
+        try:
+            with self.section( "Run" ):
+                return func( *args, **kwargs )
+        finally:
+            tracemalloc.stop()
+            type( self ).active = None
+
+            self.write()
+
+            jogobot.output( "Profile written to {filename}".format(
+                filename=self.filename ) )
+
+    @contextmanager
+    def section( self, label ):
+        """
+        Profile the enclosed code as section with given label
+
+        Function statistics of nested sections are not accounted to the
+        enclosing section. Sections with equal labels are merged.
+
+        @param label: Label of section in report
+        @type label: str
+        """
+        # Suspend enclosing section, cProfile can only run one at a time
+        if self._stack:
+            parent = self._stack[-1]
+            parent["profile"].disable()
+            parent["peak"] = max( parent["peak"],
+                                  tracemalloc.get_traced_memory()[1] )
+
+        overhead = time.perf_counter()
+        current = { "label": label,
+                    "profile": cProfile.Profile(),
+                    "peak": 0,
+                    "snapshot": tracemalloc.take_snapshot() }
+        self._stack.append( current )
+        self._overhead += time.perf_counter() - overhead
+
+        current["overhead"] = self._overhead
+        current["start"] = time.perf_counter()
+
+        # Peak of section is measured from memory in use at its start
+        current["base"] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        current["profile"].enable()
+
+        try:
+            yield
+        finally:
+            current["profile"].disable()
+            current["peak"] = max( current["peak"],
+                                   tracemalloc.get_traced_memory()[1] )
+            current["time"] = ( time.perf_counter() - current["start"] -
+                                ( self._overhead - current["overhead"] ) )
+
+            overhead = time.perf_counter()
+            self._stack.pop()
+            self._store( current )
+            self._overhead += time.perf_counter() - overhead
+
+            # Resume enclosing section
+            if self._stack:
+                parent = self._stack[-1]
+                parent["peak"] = max( parent["peak"], current["peak"] )
+                tracemalloc.reset_peak()
+                parent["profile"].enable()
+
+    def _store( self, current ):
+        """
+        Merges data of finished section into collected sections
+        """
+        if current["label"] not in self.sections:
+            self.sections[ current["label"] ] = {
+                "count": 0,
+                "time": 0.0,
+                "peak": -1,
+                "stats": pstats.Stats( current["profile"],
+                                       stream=io.StringIO() ),
+                "allocations": list() }
+        else:
+            self.sections[ current["label"] ]["stats"].add(
+                current["profile"] )
+
+        section = self.sections[ current["label"] ]
+        section["count"] += 1
+        section["time"] += current["time"]
+
+        # Comparing snapshots is expensive, so only do it for the run with
+        # highest peak of each section
+        peak = current["peak"] - current["base"]
+        if peak > section["peak"]:
+            section["peak"] = peak
+            section["allocations"] = self._compare_snapshots(
+                tracemalloc.take_snapshot(), current["snapshot"] )
+
+    def _compare_snapshots( self, snapshot, start ):
+        """
+        Returns the largest allocations made between start and snapshot,
+        ignoring those made by the profiler itself
+        """
+        ignore = ( tracemalloc.__file__, __file__ )
+        allocations = list()
+
+        for stat in snapshot.compare_to( start, "traceback" ):
+            if stat.size_diff <= 0:
+                continue
+
+            if any( frame.filename in ignore for frame in stat.traceback ):
+                continue
+
+            allocations.append( stat )
+
+            if len( allocations ) >= self.limit:
+                break
+
+        return allocations
+
+    def write( self ):
+        """
+        Writes report of collected sections to file
+        """
+        with open( self.filename, "w", encoding="utf-8" ) as fd:
+            for label, section in self.sections.items():
+
+                fd.write( "=" * 79 + "\n" )
+                fd.write( ( "{label}\n  calls: {count}, time: {time:.3f} s, " +
+                            "peak memory above start: {peak:.1f} KiB\n" )
+                          .format(
+                                label=label, count=section["count"],
+                                time=section["time"],
+                                peak=section["peak"] / 1024 ) )
+                fd.write( "=" * 79 + "\n\n" )
+
+                # Hot functions
+                stream = io.StringIO()
+                section["stats"].stream = stream
+                section["stats"].sort_stats( "cumulative", "tottime" )
+                section["stats"].print_stats( self.limit )
+                fd.write( stream.getvalue().strip( "\n" ) + "\n\n" )
+
+                # Largest allocations still alive at end of section with
+                # highest peak, not those freed before
+                fd.write( "Largest allocations still alive at end of " +
+                          "section (call with highest peak):\n\n" )
+                for stat in section["allocations"]:
+                    fd.write( "  {size:.1f} KiB in {count} blocks\n".format(
+                        size=stat.size_diff / 1024, count=stat.count_diff ) )
+                    for line in stat.traceback.format(
+                            most_recent_first=True ):
+                        fd.write( "    " + line + "\n" )
+                fd.write( "\n" )
+
+
+@contextmanager
+def section( label ):
+    """
+    Profile the enclosed code as section of the active Profiler, if any
+
+    @param label: Label of section in report
+    @type label: str
+    """
+    if Profiler.active:
+        with Profiler.active.section( label ):
+            yield
+    else:
+        yield
@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  shard.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides classes for distributing a run over multiple worker processes
+
+A coordinator splits the summary pages given by the generator into work units
+(either whole summary pages or single entries/CountryLists) and puts them into
+a SQLite based queue. Workers on the same machine, or on other machines
+sharing the queue file, take units from the queue and report their results
+back. Results of entries are written to their summary page by the worker
+which finishes the last entry of it, so saves of a page stay serialized.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pywikibot
+import mwparserfromhell as mwparser
+
+import jogobot
+
+from countrylist import CountryList
+from summarypage import SummaryPage, SummaryPageEntry
+
+
+class WorkQueue():
+    """
+    SQLite based queue of work units
+    """
+
+    # Seconds after which a claimed unit or save is given to another worker
+    lease = 1800
+
+    def __init__( self, path ):
+        """
+        Open (and maybe create) queue
+
+        @param path: Path of SQLite database file
+        @type path: str
+        """
+        self.path = path
+
+        # Autocommit mode, transactions are handled explicitly
+        self.connection = sqlite3.connect( path, timeout=60,
+                                           isolation_level=None )
+        self.connection.row_factory = sqlite3.Row
+
+        with self.transaction() as cursor:
+            cursor.execute( """CREATE TABLE IF NOT EXISTS pages (
+                title TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                worker TEXT,
+                error TEXT,
+                claimed REAL )""" )
+            cursor.execute( """CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                page TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                entry TEXT,
+                state TEXT NOT NULL DEFAULT 'queued',
+                worker TEXT,
+                claimed REAL,
+                result TEXT,
+                error TEXT )""" )
+            cursor.execute( """CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT )""" )
+
+    @contextmanager
+    def transaction( self ):
+        """
+        Runs enclosed statements in an exclusive transaction
+        """
+        cursor = self.connection.cursor()
+        cursor.execute( "BEGIN IMMEDIATE" )
+
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute( "ROLLBACK" )
+            raise
+        else:
+            cursor.execute( "COMMIT" )
+
+    def open( self ):
+        """
+        Marks queue as open, workers won't stop while queue is open
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "INSERT OR REPLACE INTO meta VALUES " +
+                            "('closed', '0')" )
+
+    def close( self ):
+        """
+        Marks queue as closed, no more pages will be added
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "INSERT OR REPLACE INTO meta VALUES " +
+                            "('closed', '1')" )
+
+    def add_page( self, title, entries=None ):
+        """
+        Add a summary page to queue
+
+        @param title: Title of summary page
+        @type title: str
+        @param entries: Texts of entry templates to queue as separate units,
+                        if None the whole page is queued as one unit
+        @type entries: list of str
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "DELETE FROM units WHERE page = ?", ( title, ) )
+
+            if entries is None:
+                cursor.execute( "INSERT OR REPLACE INTO pages " +
+                                "(title, state) VALUES (?, 'queued')",
+                                ( title, ) )
+                cursor.execute( "INSERT INTO units (page, kind) VALUES " +
+                                "(?, 'page')", ( title, ) )
+
+            # Nothing to do for pages without entries
+            elif not entries:
+                cursor.execute( "INSERT OR REPLACE INTO pages " +
+                                "(title, state) VALUES (?, 'done')",
+                                ( title, ) )
+
+            else:
+                cursor.execute( "INSERT OR REPLACE INTO pages " +
+                                "(title, state) VALUES (?, 'pending')",
+                                ( title, ) )
+                cursor.executemany( "INSERT INTO units (page, kind, entry) " +
+                                    "VALUES (?, 'entry', ?)",
+                                    [ ( title, entry ) for entry in entries ] )
+
+    def claim( self, worker ):
+        """
+        Claim next queued unit (or one whose lease has expired) for worker
+
+        @returns  Claimed unit or None if there is none
+        @rtype    sqlite3.Row
+        """
+        now = time.time()
+
+        with self.transaction() as cursor:
+            unit = cursor.execute(
+                "SELECT * FROM units WHERE state = 'queued' OR " +
+                "( state = 'claimed' AND claimed < ? ) ORDER BY id LIMIT 1",
+                ( now - type( self ).lease, ) ).fetchone()
+
+            if unit is None:
+                return None
+
+            cursor.execute( "UPDATE units SET state = 'claimed', " +
+                            "worker = ?, claimed = ? WHERE id = ?",
+                            ( worker, now, unit["id"] ) )
+
+        return unit
+
+    def renew( self, unit, worker ):
+        """
+        Extend lease of unit claimed by worker
+
+        @returns  False if unit was claimed by another worker meanwhile
+        @rtype    bool
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "UPDATE units SET claimed = ? WHERE id = ? AND " +
+                            "worker = ? AND state = 'claimed'",
+                            ( time.time(), unit["id"], worker ) )
+
+            return cursor.rowcount == 1
+
+    def complete( self, unit, result=None ):
+        """
+        Report successful treatment of unit
+
+        @param result: New text of entry template, None if entry is unchanged
+        @type result: str
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "UPDATE units SET state = 'done', result = ? " +
+                            "WHERE id = ?", ( result, unit["id"] ) )
+
+            if unit["kind"] == "page":
+                cursor.execute( "UPDATE pages SET state = 'done' " +
+                                "WHERE title = ?", ( unit["page"], ) )
+
+    def fail( self, unit, error ):
+        """
+        Report failed treatment of unit
+
+        @param error: Description of error
+        @type error: str
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "UPDATE units SET state = 'failed', error = ? " +
+                            "WHERE id = ?", ( error, unit["id"] ) )
+
+            if unit["kind"] == "page":
+                cursor.execute( "UPDATE pages SET state = 'failed', " +
+                                "error = ? WHERE title = ?",
+                                ( error, unit["page"] ) )
+
+    def claim_save( self, title, worker ):
+        """
+        Claim saving of summary page if all of its entry units are finished
+        and no other worker has claimed it before (or its lease has expired)
+
+        @returns  True if worker should save the page
+        @rtype    bool
+        """
+        now = time.time()
+
+        with self.transaction() as cursor:
+            cursor.execute(
+                "UPDATE pages SET state = 'saving', worker = ?, " +
+                "claimed = ? WHERE title = ? AND ( ( state = 'pending' " +
+                "AND NOT EXISTS ( SELECT 1 FROM units WHERE page = ? AND " +
+                "state NOT IN ('done', 'failed') ) ) OR " +
+                "( state = 'saving' AND claimed < ? ) )",
+                ( worker, now, title, title, now - type( self ).lease ) )
+
+            return cursor.rowcount == 1
+
+    def renew_save( self, title, worker ):
+        """
+        Extend lease of saving of summary page claimed by worker
+
+        @returns  False if saving was claimed by another worker meanwhile
+        @rtype    bool
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "UPDATE pages SET claimed = ? WHERE title = ? " +
+                            "AND worker = ? AND state = 'saving'",
+                            ( time.time(), title, worker ) )
+
+            return cursor.rowcount == 1
+
+    def get_expired_saves( self ):
+        """
+        Get titles of summary pages whose saving worker did not renew its
+        lease, e.g. as it crashed
+
+        @rtype    list
+        """
+        return [ row["title"] for row in self.connection.execute(
+            "SELECT title FROM pages WHERE state = 'saving' AND " +
+            "claimed < ?", ( time.time() - type( self ).lease, ) ) ]
+
+    def get_results( self, title ):
+        """
+        Get results of finished entry units of summary page
+
+        @returns  Mapping of original entry template text to new one
+        @rtype    dict
+        """
+        return { row["entry"]: row["result"] for row in
+                 self.connection.execute(
+                     "SELECT entry, result FROM units WHERE page = ? AND " +
+                     "state = 'done' AND result IS NOT NULL", ( title, ) ) }
+
+    def finish_page( self, title, error=None ):
+        """
+        Mark summary page as saved or, if error is given, as failed
+        """
+        with self.transaction() as cursor:
+            cursor.execute( "UPDATE pages SET state = ?, error = ? " +
+                            "WHERE title = ?",
+                            ( "failed" if error else "done", error, title ) )
+
+    def is_drained( self ):
+        """
+        Checks wether queue is closed and all pages are finished
+
+        @rtype    bool
+        """
+        closed = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'closed'" ).fetchone()
+
+        if not closed or closed["value"] != "1":
+            return False
+
+        return not self.connection.execute(
+            "SELECT 1 FROM pages WHERE state NOT IN ('done', 'failed') " +
+            "LIMIT 1" ).fetchone()
+
+    def get_status( self ):
+        """
+        Count pages per state
+
+        @rtype    dict
+        """
+        return { row["state"]: row["count"] for row in
+                 self.connection.execute(
+                     "SELECT state, COUNT(*) AS count FROM pages " +
+                     "GROUP BY state" ) }
+
+
+class ShardCoordinator():
+    """
+    Splits summary pages of bots generator into work units
+    """
+
+    def __init__( self, bot, queue, units="countrylist", poll=10 ):
+        """
+        Constructor
+
+        @param bot: Bot whose generator gives the summary pages
+        @type bot: ChartsBot
+        @param queue: Queue to put work units in
+        @type queue: WorkQueue
+        @param units: "page" to queue whole summary pages, "countrylist" to
+                      queue each entry (and its CountryList) separately
+        @type units: str
+        @param poll: Seconds to wait between checks for finished queue
+        @type poll: int
+        """
+        if units not in ( "page", "countrylist" ):
+            raise ShardError( "Unknown kind of work units: " + str(units) )
+
+        self.bot = bot
+        self.queue = queue
+        self.units = units
+        self.poll = poll
+
+    def run( self ):
+        """
+        Queue all pages of generator and wait till workers finished them
+        """
+        self.queue.open()
+
+        count = 0
+        for page in self.bot.generator:
+
+            if self.units == "page":
+                self.queue.add_page( page.title() )
+
+            else:
+                text = self.bot.load( page )
+                if not text:
+                    continue
+
+                self.queue.add_page( page.title(), [
+                    str( entry ) for entry in
+                    SummaryPage( text ).get_entry_templates() ] )
+
+            count += 1
+
+        self.queue.close()
+
+        jogobot.output( "Queued {count} page(s) in {path}".format(
+            count=count, path=self.queue.path ) )
+
+        while not self.queue.is_drained():
+            time.sleep( self.poll )
+
+        status = self.queue.get_status()
+        jogobot.output( ( "Sharded run finished, {done} page(s) done, " +
+                          "{failed} page(s) failed" ).format(
+                              done=status.get( "done", 0 ),
+                              failed=status.get( "failed", 0 ) ) )
+
+
+class ShardWorker():
+    """
+    Treats work units from queue
+    """
+
+    def __init__( self, bot, queue, name=None, poll=5 ):
+        """
+        Constructor
+
+        @param bot: Bot used for loading, treating and saving pages
+        @type bot: ChartsBot
+        @param queue: Queue to take work units from
+        @type queue: WorkQueue
+        @param name: Name of worker, defaults to host:pid
+        @type name: str
+        @param poll: Seconds to wait if queue is empty but not drained
+        @type poll: int
+        """
+        self.bot = bot
+        self.queue = queue
+        self.poll = poll
+
+        if name:
+            self.name = name
+        else:
+            self.name = "{host}:{pid}".format( host=socket.gethostname(),
+                                               pid=os.getpid() )
+
+    def run( self ):
+        """
+        Take units from queue until it is drained
+        """
+        treated = 0
+
+        while True:
+            unit = self.queue.claim( self.name )
+
+            if unit is not None:
+                self.treat( unit )
+                treated += 1
+
+            # Take over saves of crashed workers
+            elif self.queue.get_expired_saves():
+                for title in self.queue.get_expired_saves():
+                    self.maybe_save( title )
+
+            elif self.queue.is_drained():
+                break
+
+            else:
+                time.sleep( self.poll )
+
+        CountryList.link_index.save()
+
+        jogobot.output( "Worker {name} finished, {treated} unit(s) treated"
+                        .format( name=self.name, treated=treated ) )
+
+    @contextmanager
+    def heartbeat( self, renew ):
+        """
+        Renew lease of unit or save while enclosed code runs, so no other
+        worker claims it while it is still in progress
+
+        @param renew: Called with a queue to renew the lease in
+        @type renew: callable
+        """
+        stop = threading.Event()
+
+        def beat():
+            # SQLite connections must not be shared between threads
+            queue = WorkQueue( self.queue.path )
+
+            try:
+                while not stop.wait( WorkQueue.lease / 3 ):
+                    renew( queue )
+            finally:
+                queue.connection.close()
+
+        thread = threading.Thread( target=beat, daemon=True )
+        thread.start()
+
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def treat( self, unit ):
+        """
+        Treat given unit and report result to queue
+        """
+        try:
+            with self.heartbeat(
+                    lambda queue: queue.renew( unit, self.name ) ):
+                self.treat_unit( unit )
+
+        except Exception as error:
+            jogobot.output( "Unit {id} of [[{page}]] failed: {error}".format(
+                id=unit["id"], page=unit["page"], error=repr( error ) ),
+                "ERROR" )
+            self.queue.fail( unit, repr( error ) )
+
+        if unit["kind"] == "entry":
+            self.maybe_save( unit["page"] )
+
+    def treat_unit( self, unit ):
+        """
+        Treat page or entry of given unit and report result to queue
+        """
+        if unit["kind"] == "page":
+            page = pywikibot.Page( self.bot.site, unit["page"] )
+
+            if not self.bot.treat( page ):
+                raise ShardError( "Page could not be loaded or saved" )
+
+            self.queue.complete( unit )
+
+        else:
+            self.queue.complete( unit, self.treat_entry( unit["entry"] ) )
+
+    def treat_entry( self, entry ):
+        """
+        Treat a single summary page entry
+
+        @param entry: Text of entry template
+        @type entry: str
+
+        @returns  New text of entry template or None if it does not need to
+                  be written, e.g. only Liste_Revision changed
+        @rtype    str
+        """
+        template = next( mwparser.parse( entry ).ifilter_templates() )
+
+        summarypageentry = SummaryPageEntry(
+            template, force_reload=self.bot.force_reload )
+
+        # Only own category is parsed, there is nothing to share with
+        # further units
+        try:
+            summarypageentry.treat()
+        finally:
+            CountryList.shared_results.clear()
+
+        if not summarypageentry.is_write_needed():
+            return None
+
+        return str( summarypageentry.get_entry().template )
+
+    def maybe_save( self, title ):
+        """
+        Save summary page with results of its entries if all are finished and
+        no other worker does it
+        """
+        if not self.queue.claim_save( title, self.name ):
+            return
+
+        try:
+            with self.heartbeat(
+                    lambda queue: queue.renew_save( title, self.name ) ):
+                self.save( title )
+
+        except Exception as error:
+            jogobot.output( "Saving [[{page}]] failed: {error}".format(
+                page=title, error=repr( error ) ), "ERROR" )
+            self.queue.finish_page( title, repr( error ) )
+
+        else:
+            self.queue.finish_page( title )
+
+
+    def save( self, title ):
+        """
+        Apply results of entries to current text of summary page and save it
+        """
+        page = pywikibot.Page( self.bot.site, title )
+        text = self.bot.load( page )
+
+        if not text:
+            raise ShardError( "Page could not be loaded" )
+
+        results = self.queue.get_results( title )
+        sumpage = SummaryPage( text )
+        text = sumpage.apply( results )
+
+        if self.bot.save( text, page, self.bot.summary, False,
+                          results=results,
+                          applied=sumpage.applied ) is False:
+            raise ShardError( "Page could not be saved" )
+
+
+class ShardError( Exception ):
+    """
+    Handles errors occuring in sharded runs
+    """
+    pass
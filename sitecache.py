@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  sitecache.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides a persistent cache of the requests pywikibot sends at start of each
+run (siteinfo and userinfo), used as hook around pywikibot API requests
+
+Siteinfo is reused for a day. Userinfo belongs to the login session, it is
+only reused while the session cookies are unchanged and at most once per key
+and run: asking again, e.g. after a lost login, reaches the wiki and
+refreshes the stored answer. Tokens are never stored, as the file would
+allow editing in the name of the bot.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from pywikibot.comms import http
+
+import apihooks
+import metrics
+
+
+class SiteCache():
+    """
+    Stores answers to startup requests in a JSON file
+    """
+
+    # Seconds siteinfo is reused
+    siteinfo_ttl = 24 * 3600
+
+    # Seconds userinfo is reused at most
+    session_ttl = 6 * 3600
+
+    # Meta modules of session requests
+    session_meta = ( "userinfo", )
+
+    def __init__( self, path, session_ttl=None ):
+        """
+        Constructor
+
+        @param path: JSON file to store answers in
+        @type path: str
+        @param session_ttl: Seconds userinfo is reused at most
+        @type session_ttl: float
+        """
+        self.path = path
+
+        if session_ttl is not None:
+            self.session_ttl = session_ttl
+
+        self.entries = dict()
+
+        # Keys answered from file in this run
+        self.served = set()
+
+        self.lock = threading.Lock()
+
+    def load( self ):
+        """
+        Read stored answers, dropping expired ones and those which must
+        not be stored any more, e.g. tokens
+        """
+        try:
+            with open( self.path, encoding="utf-8" ) as fd:
+                entries = json.load( fd )
+        except ( OSError, ValueError ):
+            entries = dict()
+
+        now = time.time()
+        self.entries = { key: entry for key, entry in entries.items()
+                         if entry["expires"] > now and self.get_kind(
+                             dict( json.loads( key )[1] ) ) }
+
+    def save( self ):
+        """
+        Write stored answers to file, replacing it at once
+
+        Each process writes its own temporary file, readable by the owner
+        only, so concurrent runs do not interfere
+        """
+        with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", delete=False,
+                dir=os.path.dirname( os.path.abspath( self.path ) ),
+                prefix=os.path.basename( self.path ) + ".",
+                suffix=".tmp" ) as fd:
+            try:
+                json.dump( self.entries, fd, ensure_ascii=False )
+            except BaseException:
+                os.remove( fd.name )
+                raise
+
+        try:
+            os.replace( fd.name, self.path )
+        except OSError:
+            os.remove( fd.name )
+            raise
+
+    def activate( self ):
+        """
+        Load file and start answering startup requests
+        """
+        self.load()
+        apihooks.add( self.cache_request )
+
+    def deactivate( self ):
+        """
+        Stop answering startup requests
+        """
+        apihooks.remove( self.cache_request )
+
+    @staticmethod
+    def get_params( request ):
+        """
+        Returns params of request as dict of strings
+        """
+        return { key: "|".join( str( item ) for item in value )
+                 if isinstance( value, list ) else str( value )
+                 for key, value in getattr( request, "_params",
+                                            dict() ).items() }
+
+    @staticmethod
+    def get_session():
+        """
+        Returns fingerprint of current, unexpired cookies
+        """
+        cookies = sorted( ( cookie.domain, cookie.name, cookie.value )
+                          for cookie in http.cookie_jar
+                          if not cookie.is_expired() )
+
+        return hashlib.sha1( json.dumps( cookies ).encode(
+            "utf-8" ) ).hexdigest()
+
+    def get_kind( self, params ):
+        """
+        Returns "site" for siteinfo requests, "session" for userinfo
+        requests and None for all others, e.g. tokens
+        """
+        meta = set( params.get( "meta", "" ).split( "|" ) )
+
+        if( params.get( "action" ) != "query" or "prop" in params or
+                "list" in params or "titles" in params or
+                not meta <= { "siteinfo" }.union(
+                    type( self ).session_meta ) ):
+            return None
+        elif meta & set( type( self ).session_meta ):
+            return "session"
+
+        return "site"
+
+    def cache_request( self, request, submit ):
+        """
+        API hook answering startup requests from file where possible
+        """
+        params = type( self ).get_params( request )
+        kind = self.get_kind( params )
+
+        if kind is None:
+            return submit()
+
+        key = json.dumps( [ str( request.site ), sorted( params.items() ) ],
+                          ensure_ascii=False )
+        session = type( self ).get_session() if kind == "session" else None
+
+        with self.lock:
+            entry = self.entries.get( key )
+
+            if( entry and entry["expires"] > time.time() and
+                    entry["session"] == session and
+                    ( kind == "site" or key not in self.served ) ):
+                self.served.add( key )
+                metrics.inc( "site_cache", result="hit" )
+                return entry["data"]
+
+        metrics.inc( "site_cache", result="miss" )
+        data = submit()
+
+        if "error" in data:
+            return data
+
+        ttl = ( type( self ).siteinfo_ttl if kind == "site"
+                else self.session_ttl )
+
+        with self.lock:
+            # Session may have been started by this request
+            self.entries[ key ] = {
+                "data": data, "expires": time.time() + ttl,
+                "session": type( self ).get_session()
+                if kind == "session" else None }
+            self.served.add( key )
+            self.save()
+
+        return data
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  streaming.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides helpers for processing page generators within a memory budget
+"""
+
+import gc
+import os
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import jogobot
+
+
+def current_memory():
+    """
+    Returns resident memory of current process in bytes
+
+    Falls back to peak memory if current usage is not available on this
+    platform, or None if neither is
+    """
+    try:
+        with open( "/proc/self/statm" ) as fd:
+            return int( fd.read().split()[1] ) * os.sysconf( "SC_PAGE_SIZE" )
+    except ( OSError, ValueError, IndexError ):
+        return peak_memory()
+
+
+def peak_memory():
+    """
+    Returns peak resident memory of current process in bytes or None if not
+    available on this platform
+    """
+    if not resource:
+        return None
+
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+    # Linux reports KiB, Mac OS bytes
+    if os.uname().sysname != "Darwin":
+        peak *= 1024
+
+    return peak
+
+
+def release_page( page ):
+    """
+    Drops cached text and revisions of a pywikibot page object while keeping
+    page info like latest_revision_id
+
+    @param page: Page to release text of
+    @type page: pywikibot.Page
+    """
+    if hasattr( page, "_text" ):
+        del page._text
+
+    if getattr( page, "_revisions", None ):
+        page._revisions = {}
+
+
+def fit_groupsize( headroom, average_size, max_groupsize ):
+    """
+    Returns number of pages to preload at once within given headroom
+
+    @param headroom: Memory left within budget in bytes
+    @type headroom: int
+    @param average_size: Average text length of pages, None if not known
+    @type average_size: float
+    @param max_groupsize: Maximal number of pages
+    @type max_groupsize: int
+    @rtype    int
+    """
+    # Over budget, only fetch one page at a time
+    if headroom <= 0 or not average_size:
+        return 1
+
+    per_page = average_size * StreamingPreloader.expansion
+    return max( 1, min( max_groupsize, int( headroom // per_page ) ) )
+
+
+class StreamingPreloader():
+    """
+    Replacement for pagegenerators.PreloadingGenerator which adapts its
+    prefetch depth to stay within a memory budget and drops the text of
+    pages as soon as the next page is requested
+    """
+
+    # Maximal and initial number of pages preloaded at once
+    max_groupsize = 50
+    initial_groupsize = 5
+
+    # Estimated ratio of memory needed for a treated page to its text length
+    # (page text, parse tree, new text and diff)
+    expansion = 25
+
+    def __init__( self, generator, budget ):
+        """
+        Constructor
+
+        @param generator: the page generator whose pages should be preloaded
+        @type generator: generator
+        @param budget: Memory budget in bytes
+        @type budget: int
+        """
+        self.generator = iter( generator )
+        self.budget = budget
+
+        self.groupsize = type( self ).initial_groupsize
+
+        # Running average of page text length
+        self._average_size = None
+        self._pages = 0
+
+        # Highest memory usage seen while streaming
+        self.peak = 0
+
+        # Wether budget is currently exceeded, to warn only once
+        self._exceeded = False
+
+    def __iter__( self ):
+        """
+        Yield preloaded pages one by one
+        """
+        buffer = deque()
+        previous = None
+
+        while True:
+
+            # Drop text of page the consumer is done with
+            if previous is not None:
+                release_page( previous )
+                previous = None
+                self.check_memory()
+
+            if not buffer:
+                group = self._next_group()
+                if not group:
+                    break
+
+                site = group[0].site
+                for page in site.preloadpages( group,
+                                               groupsize=len( group ) ):
+                    buffer.append( page )
+                    self._account( page )
+
+            # Pop page, so buffer does not hold it any longer than needed
+            previous = buffer.popleft()
+            yield previous
+
+    def _next_group( self ):
+        """
+        Collect the next group of pages from wrapped generator
+        """
+        group = list()
+
+        for page in self.generator:
+            group.append( page )
+
+            if len( group ) >= self.groupsize:
+                break
+
+        return group
+
+    def _account( self, page ):
+        """
+        Update average page size with given preloaded page
+        """
+        try:
+            size = len( page.text )
+        except Exception:
+            return
+
+        self._pages += 1
+        if self._average_size is None:
+            self._average_size = size
+        else:
+            self._average_size += ( size - self._average_size ) / self._pages
+
+    def check_memory( self ):
+        """
+        Measure memory usage, collect garbage if over budget and adapt prefetch
+        depth to remaining headroom
+        """
+        usage = current_memory()
+
+        if usage is None:
+            return
+
+        if usage > self.budget:
+            gc.collect()
+            usage = current_memory()
+
+        self.peak = max( self.peak, usage )
+
+        headroom = self.budget - usage
+
+        if headroom <= 0 and not self._exceeded:
+            jogobot.output( ( "Memory usage {usage:.1f} MiB exceeds " +
+                              "budget of {budget:.1f} MiB" ).format(
+                                  usage=usage / 2**20,
+                                  budget=self.budget / 2**20 ), "WARNING" )
+        self._exceeded = headroom <= 0
+
+        self.groupsize = fit_groupsize( headroom, self._average_size,
+                                        type( self ).max_groupsize )
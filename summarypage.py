@@ -25,13 +25,21 @@
 Provides classes for handling Charts summary page
 """
 
+import re
+from bisect import bisect_right
 from datetime import datetime, timedelta
 
-# import pywikibot
+import pywikibot
+from pywikibot.data import api
 import mwparserfromhell as mwparser
 
 import jogobot
 
+import deadline
+import metrics
+import streaming
+import timeouts
+import tracing
 from countrylist import CountryList, CountryListError
 
 
@@ -40,6 +48,16 @@ class SummaryPage():
     Handles summary page related actions
     """
 
+    # LinkResolver used to check links of updated entries, if any
+    link_resolver = None
+
+    # Number of CountryList texts fetched per request
+    preload_groupsize = 50
+
+    # Memory budget in bytes preloaded CountryList texts are fitted in, if
+    # any
+    memory_budget = None
+
     def __init__( self, text, force_reload=False ):
         """
         Create Instance
@@ -52,31 +70,471 @@ class SummaryPage():
 
         """
 
-        # Parse Text with mwparser
-        self.wikicode = mwparser.parse( text )
+        # Locate entry templates, only they are parsed with mwparser
+        self.text = SummaryPageText( text )
 
         # Force parsing of countrylist
         self.force_reload = force_reload
 
+        # Running average of text length of preloaded CountryLists
+        self._average_size = None
+        self._preloaded = 0
+
     def treat( self ):
         """
         Handles parsing/editing of text
         """
 
+        # Keep treated entries to be able to get their results later
+        self.entries = list()
+
+        # Entries left untouched as deadline of run was reached
+        self.deferred = list()
+
         # Get mwparser.template objects for Template "/Eintrag"
-        for entry in self.wikicode.filter_templates( matches="/Eintrag" ):
+        entries = self.get_entry_templates()
+
+        # Look up latest revisions of all CountryLists at once
+        lists = self.get_countrylist_infos( entries )
+        self.categories = self.get_countrylist_categories( entries, lists )
+        latest = type( self ).get_latest_revids(
+            { title for title, revid, hervor in lists.values() if title } )
+
+        # CountryLists do not need to look up their revision again
+        self.revids = { key: latest.get( title )
+                        for key, ( title, revid, hervor ) in lists.items() }
+
+        # With limited time, treat most important entries first
+        if deadline.Deadline.active:
+            entries = self.prioritize_entries( entries, lists, latest )
+
+        # Changes of CountryLists since saved revision are read from diffs,
+        # so their texts are only fetched if changes do not suffice
+        delta = self.get_delta_entries( entries, lists, latest )
+
+        # Texts of other CountryLists are fetched in batches, as their
+        # entries are treated
+        try:
+            for group in self.preload_groups( entries, lists, latest,
+                                              delta ):
+                self.treat_entries( group )
+        finally:
+            # Drop texts of preloaded pages and results shared between
+            # entries, also if treatment failed
+            CountryList.preloaded.clear()
+            CountryList.shared_results.clear()
+
+        if type( self ).link_resolver:
+            self.resolve_links()
+
+    def treat_entries( self, entries ):
+        """
+        Treat given entries and replace them in text
+        """
+        for entry in entries:
+
+            if not deadline.allows():
+                self.deferred.append( entry )
+                continue
 
             # Instantiate SummaryPageEntry-object
-            summarypageentry = SummaryPageEntry(entry,
-                                                force_reload=self.force_reload)
+            summarypageentry = SummaryPageEntry(
+                entry, force_reload=self.force_reload,
+                categories=self.categories.get( id( entry ) ),
+                latest_revid=self.revids.get( id( entry ) ) )
 
             # Treat SummaryPageEntry-object
-            summarypageentry.treat()
+            try:
+                with tracing.span( "SummaryPageEntry", "entry",
+                                   liste=entry.get( "Liste" ).value.strip()
+                                   if entry.has( "Liste" ) else None ), \
+                        deadline.measure():
+                    summarypageentry.treat()
+
+            # Entry keeps its old values, like with unparsed CountryList
+            except timeouts.RequestTimeout as error:
+                jogobot.output( "Entry {entry} not updated: {error}".format(
+                    entry=summarypageentry.key, error=error ), "WARNING" )
+                metrics.inc( "entries_timed_out" )
+                continue
+
+            self.entries.append( summarypageentry )
 
             # Get result
             # We need to replace origninal entry since objectid changes due to
             # recreation of template object and reassignment won't be reflected
-            self.wikicode.replace(entry, summarypageentry.get_entry().template)
+            self.text.replace( entry, summarypageentry.get_entry().template )
+
+            # Results are extracted, CountryList is not needed any more
+            summarypageentry.countrylist.release()
+
+    def resolve_links( self ):
+        """
+        Check unlinked names and link targets of all updated entries in one
+        batched lookup and apply results to entries
+        """
+        entries = [ entry for entry in self.entries
+                    if entry.countrylist.parsed ]
+
+        names = set()
+        for entry in entries:
+            names.update( entry.countrylist.unresolved )
+
+            for value in ( entry.new_entry.Interpret, entry.new_entry.Titel ):
+                names.update( str( wikilink.title ).strip() for wikilink
+                              in value.ifilter_wikilinks() )
+
+        type( self ).link_resolver.query( names )
+
+        for entry in entries:
+            entry.new_entry.Interpret = type( self ).link_resolver.resolve(
+                entry.new_entry.Interpret, entry.countrylist.unresolved )
+            entry.new_entry.Titel = type( self ).link_resolver.resolve(
+                entry.new_entry.Titel, entry.countrylist.unresolved )
+
+            entry.is_write_needed()
+
+    def get_countrylist_infos( self, entries ):
+        """
+        Reads title and saved revision of CountryList and highlighting of
+        given entries
+
+        @returns  Mapping of id of entry to title (None if broken), revid
+                  and wether entry is highlighted (param Hervor)
+        @rtype    dict
+        """
+        lists = dict()
+
+        for entry in entries:
+            template = SummaryPageEntryTemplate( entry )
+
+            # Broken entries fail on treatment anyway
+            try:
+                title = str( next( template.Liste.ifilter_wikilinks() ).title )
+            except ( AttributeError, StopIteration ):
+                title = None
+
+            try:
+                revid = int( str( template.Liste_Revision or 0 ).strip() )
+            except ValueError:
+                revid = 0
+
+            lists[ id( entry ) ] = ( title and title.strip(), revid, bool(
+                template.Hervor and str( template.Hervor ).strip() ) )
+
+        return lists
+
+    def get_countrylist_categories( self, entries, lists ):
+        """
+        Collects chart categories of all entries linking the same
+        CountryList, so their latest entries are extracted in one parse
+
+        @param lists: Infos of entries as returned by get_countrylist_infos()
+        @type lists: dict
+        @returns  Mapping of id of entry to chart categories
+        @rtype    dict
+        """
+        categories = dict()
+
+        for entry in entries:
+            categories.setdefault( lists[ id( entry ) ][0], set() ).add(
+                SummaryPageEntry.get_category( entry ) )
+
+        return { id( entry ): tuple( sorted(
+                     categories[ lists[ id( entry ) ][0] ] ) )
+                 for entry in entries }
+
+    def prioritize_entries( self, entries, lists, latest ):
+        """
+        Sort entries by importance: highlighted ones (param Hervor) first,
+        then those whose CountryList changed, most recently changed first
+
+        @param lists: Infos of entries as returned by get_countrylist_infos()
+        @type lists: dict
+        @param latest: Latest revids of CountryLists by title
+        @type latest: dict
+        @returns  Sorted entries
+        @rtype    list
+        """
+        def priority( entry ):
+            title, revid, hervor = lists[ id( entry ) ]
+            current = latest.get( title, 0 )
+
+            return ( not hervor, current == revid, -current )
+
+        return sorted( entries, key=priority )
+
+    def get_delta_entries( self, entries, lists, latest ):
+        """
+        Returns ids of entries whose CountryList changed since its saved
+        revision, so only the changes may be parsed
+
+        @param lists: Infos of entries as returned by get_countrylist_infos()
+        @type lists: dict
+        @param latest: Latest revids of CountryLists by title
+        @type latest: dict
+        @rtype    set
+        """
+        delta = set()
+
+        if self.force_reload:
+            return delta
+
+        for entry in entries:
+            title, revid, hervor = lists[ id( entry ) ]
+
+            if revid and title in latest and latest[ title ] != revid:
+                delta.add( id( entry ) )
+
+        return delta
+
+    def preload_groups( self, entries, lists, latest, delta ):
+        """
+        Yield given entries in order in groups with the texts of their
+        CountryLists whose revision changed, or of all with force_reload,
+        preloaded. Entries linking the same CountryList are kept in one
+        group, texts are dropped after the group is treated.
+
+        @param lists: Infos of entries as returned by get_countrylist_infos()
+        @type lists: dict
+        @param latest: Latest revids of CountryLists by title
+        @type latest: dict
+        @param delta: Ids of entries only changes of whose CountryList are
+                      parsed, if they suffice, so text is not preloaded
+        @type delta: set
+        """
+        def needs_text( entry ):
+            title, revid, hervor = lists[ id( entry ) ]
+            return id( entry ) not in delta and title in latest and (
+                self.force_reload or latest[ title ] != revid )
+
+        entries = list( entries )
+
+        while entries:
+            groupsize = self.get_preload_groupsize()
+            group = list()
+            titles = list()
+
+            while entries and len( titles ) < groupsize:
+                entry = entries.pop( 0 )
+                group.append( entry )
+
+                if not needs_text( entry ):
+                    continue
+
+                # Take along later entries linking the same CountryList
+                title = lists[ id( entry ) ][0]
+                titles.append( title )
+                group.extend( other for other in entries
+                              if lists[ id( other ) ][0] == title )
+                entries = [ other for other in entries
+                            if lists[ id( other ) ][0] != title ]
+
+            self.preload_countrylists( titles )
+
+            try:
+                yield group
+            finally:
+                # Drop texts of preloaded pages, also of unused ones
+                for title in titles:
+                    page = CountryList.preloaded.pop( title, None )
+                    if page is not None:
+                        streaming.release_page( page )
+
+    def get_preload_groupsize( self ):
+        """
+        Returns number of CountryLists to preload at once, fitted into
+        memory budget if any
+
+        @rtype    int
+        """
+        if not type( self ).memory_budget:
+            return type( self ).preload_groupsize
+
+        usage = streaming.current_memory()
+
+        if usage is None:
+            return type( self ).preload_groupsize
+
+        if self._average_size is None:
+            return streaming.StreamingPreloader.initial_groupsize
+
+        return streaming.fit_groupsize( type( self ).memory_budget - usage,
+                                        self._average_size,
+                                        type( self ).preload_groupsize )
+
+    def preload_countrylists( self, titles ):
+        """
+        Fetch texts of given CountryLists in batched requests. CountryList
+        takes these pages instead of loading each text on its own.
+
+        @param titles: Titles of CountryLists
+        @type titles: list
+        """
+        if not titles:
+            return
+
+        site = pywikibot.Site()
+        pages = [ pywikibot.Page( site, title ) for title in titles ]
+
+        with metrics.timer( "phase_duration_seconds", phase="preload" ), \
+                tracing.span( "Preload", "page", pages=len( pages ) ):
+
+            # Pages are updated in place, those not reached load their text
+            # on their own
+            try:
+                for page in site.preloadpages(
+                        pages, groupsize=type( self ).preload_groupsize ):
+                    self._account( page )
+            except pywikibot.Error as error:
+                jogobot.output( "Preloading failed: {error}".format(
+                    error=repr( error ) ), "WARNING" )
+
+        CountryList.preloaded.update( zip( titles, pages ) )
+
+    def _account( self, page ):
+        """
+        Update average text length of preloaded CountryLists with given page
+        """
+        try:
+            size = len( page.text )
+        except Exception:
+            return
+
+        self._preloaded += 1
+        if self._average_size is None:
+            self._average_size = size
+        else:
+            self._average_size += ( size - self._average_size ) / \
+                self._preloaded
+
+    @staticmethod
+    def get_latest_revids( titles, batchsize=50 ):
+        """
+        Look up latest revision ids of given pages
+
+        @returns  Mapping of title to revid, missing pages are left out
+        @rtype    dict
+        """
+        titles = sorted( titles )
+        latest = dict()
+
+        for start in range( 0, len( titles ), batchsize ):
+            batch = titles[ start:start + batchsize ]
+
+            try:
+                data = api.Request( site=pywikibot.Site(), parameters={
+                    "action": "query",
+                    "titles": "|".join( batch ),
+                    "prop": "info" } ).submit().get( "query", dict() )
+            except pywikibot.Error as error:
+                jogobot.output( "Revision lookup failed: {error}".format(
+                    error=repr( error ) ), "WARNING" )
+                continue
+
+            pages = data.get( "pages", dict() )
+            if isinstance( pages, dict ):
+                pages = pages.values()
+            revids = { page["title"]: page.get( "lastrevid", 0 )
+                       for page in pages }
+
+            # Map back to titles as given
+            normalized = { item["from"]: item["to"]
+                           for item in data.get( "normalized", list() ) }
+            for title in batch:
+                revid = revids.get( normalized.get( title, title ) )
+                if revid:
+                    latest[ title ] = revid
+
+        return latest
+
+    def get_entry_templates( self ):
+        """
+        Returns list of mwparser.template objects for Template "/Eintrag"
+        """
+        return self.text.get_entries()
+
+    def get_results( self ):
+        """
+        Returns results of treated entries whose CountryList was parsed
+
+        @returns  Mapping of original entry template text to new one
+        @rtype    dict
+        """
+        return { entry.key: str( entry.get_entry().template )
+                 for entry in self.entries if entry.countrylist.parsed }
+
+    @staticmethod
+    def get_changes( results ):
+        """
+        Returns changes made by given results, leaving out entries differing
+        only in Liste_Revision
+
+        @param results: Mapping of original entry template text to new one,
+                        as applied to the saved text
+        @type results: dict
+        @returns  Country, chart category, CountryList with its revision and
+                  old and new values per changed entry
+        @rtype    list of dict
+        """
+        changes = list()
+
+        for old_text, new_text in results.items():
+            old_entry = SummaryPageEntryTemplate(
+                next( mwparser.parse( old_text ).ifilter_templates() ) )
+            new_entry = SummaryPageEntryTemplate(
+                next( mwparser.parse( new_text ).ifilter_templates() ) )
+
+            if not( old_entry != new_entry ):
+                continue
+
+            old = old_entry.get_snapshot()
+            new = new_entry.get_snapshot()
+
+            try:
+                wikilink = next( new_entry.Liste.ifilter_wikilinks() )
+            except ( AttributeError, StopIteration ):
+                continue
+
+            try:
+                revid = int( new[ "Liste_Revision" ] )
+            except ( TypeError, ValueError ):
+                revid = None
+
+            changes.append( {
+                "country": str( wikilink.text or wikilink.title ).strip(),
+                "category": SummaryPageEntry.get_category(
+                    new_entry.template ),
+                "liste": str( wikilink.title ).strip(),
+                "revid": revid,
+                "old": { name.lower(): old[ name ] for name in
+                         ( "Interpret", "Titel", "Chartein" ) },
+                "new": { name.lower(): new[ name ] for name in
+                         ( "Interpret", "Titel", "Chartein" ) } } )
+
+        return changes
+
+    def apply( self, results ):
+        """
+        Replaces entry templates with already computed results instead of
+        treating them. Entries changed in the meantime are not touched.
+
+        @param results: Mapping of original entry template text to new one,
+                        as returned by get_results()
+        @type results: dict
+
+        @returns  New text of summarypage
+        @rtype    str
+        """
+        # Results found in text, to report them after saving
+        self.applied = dict()
+
+        for entry in self.get_entry_templates():
+            if str( entry ) in results:
+                self.text.replace( entry, results[ str( entry ) ] )
+                self.applied[ str( entry ) ] = results[ str( entry ) ]
+
+        return self.text.get_text()
 
     def get_new_text( self ):
         """
@@ -86,11 +544,177 @@ class SummaryPage():
         # Get information wether writing is needed from class attribute
         if SummaryPageEntry.write_needed:
 
-            # Convert wikicode back to string and return
-            return str( self.wikicode )
+            # Splice entries into original text and return
+            return self.text.get_text()
 
         return False
 
+    def release( self ):
+        """
+        Drops text and entries of summarypage to free memory
+        """
+        self.text = None
+
+
+class SummaryPageText():
+    """
+    Locates entry templates (Template "/Eintrag") in raw text of summary
+    page and parses only them. Replaced entries are spliced into the text in
+    place, so it stays untouched outside of them.
+    """
+
+    # Start of template whose name contains "/Eintrag"
+    entry_start = re.compile( r"\{\{[^{}|<>\[\]]*?/Eintrag", re.I )
+
+    # Opening and closing braces of templates
+    braces = re.compile( r"\{\{|\}\}" )
+
+    # Comments and tags whose content is not parsed as wikitext
+    masked = re.compile( r"<!--.*?(?:-->|$)|<(nowiki|pre|source|" +
+                         r"syntaxhighlight)\b[^>]*?(?<!/)>.*?</\1\s*>",
+                         re.I | re.S )
+
+    def __init__( self, text ):
+        """
+        Constructor
+
+        @param text: Page text of summary page
+        @type text: str
+        """
+        self.text = text
+
+        # Start and end offset of masked regions
+        self.masks = [ match.span() for match in
+                       type( self ).masked.finditer( text ) ]
+        self._mask_starts = [ start for start, end in self.masks ]
+
+        # Start and end offset and template of entries, in order of text
+        self.spans = list()
+
+        # Replacements (template or text) by index of span
+        self.replacements = dict()
+
+        if not self.scan():
+            metrics.inc( "summarypage_scans", result="fallback" )
+            self.scan_wikicode()
+
+        # Indexes of spans by id of their template
+        self._indexes = { id( template ): index for index, ( start, end,
+                          template ) in enumerate( self.spans ) }
+
+    def is_masked( self, offset ):
+        """
+        Checks wether offset is in comment or unparsed tag
+        """
+        index = bisect_right( self._mask_starts, offset ) - 1
+
+        return index >= 0 and offset < self.masks[ index ][1]
+
+    def find_end( self, start ):
+        """
+        Returns offset after closing braces of template starting at given
+        offset, None if it is not closed
+        """
+        depth = 0
+
+        for match in type( self ).braces.finditer( self.text, start ):
+            if self.is_masked( match.start() ):
+                continue
+
+            depth += 1 if match.group() == "{{" else -1
+
+            if depth == 0:
+                return match.end()
+
+        return None
+
+    def scan( self ):
+        """
+        Locate entries by their braces and parse each of them
+
+        @returns  False if text of an entry was not parsed as exactly one
+                  template, e.g. due to unusual nesting
+        @rtype    bool
+        """
+        position = 0
+
+        for match in type( self ).entry_start.finditer( self.text ):
+            start = match.start()
+
+            # Entries within entries are not treated on their own
+            if start < position or self.is_masked( start ):
+                continue
+
+            end = self.find_end( start )
+            if end is None:
+                return False
+
+            wikicode = mwparser.parse( self.text[ start:end ] )
+
+            if( len( wikicode.nodes ) != 1 or not isinstance(
+                    wikicode.nodes[0], mwparser.nodes.Template ) ):
+                return False
+
+            self.spans.append( ( start, end, wikicode.nodes[0] ) )
+            position = end
+
+        return True
+
+    def scan_wikicode( self ):
+        """
+        Locate entries by parsing the whole text, used if scanning failed
+        """
+        self.spans = list()
+        position = 0
+
+        for template in mwparser.parse( self.text ).ifilter_templates():
+            if not re.search( "/Eintrag", str( template.name ), re.I ):
+                continue
+
+            # Text of templates is unchanged by parsing
+            start = self.text.find( str( template ), position )
+            if start < 0:
+                continue
+
+            position = start + len( str( template ) )
+            self.spans.append( ( start, position, template ) )
+
+    def get_entries( self ):
+        """
+        Returns list of mwparser.template objects of entries
+        """
+        return [ template for start, end, template in self.spans ]
+
+    def replace( self, entry, new ):
+        """
+        Replace entry by new template or text
+
+        @param entry: Entry as returned by get_entries()
+        @type entry: mwparser.template
+        @param new: Template, changes to it until get_text() are included
+        @type new: mwparser.template or str
+        """
+        if id( entry ) not in self._indexes:
+            raise ValueError( "Entry not found in summary page" )
+
+        self.replacements[ self._indexes[ id( entry ) ] ] = new
+
+    def get_text( self ):
+        """
+        Returns text with replaced entries spliced in
+        """
+        parts = list()
+        position = 0
+
+        for index, ( start, end, template ) in enumerate( self.spans ):
+            parts.append( self.text[ position:start ] )
+            parts.append( str( self.replacements.get( index, template ) ) )
+            position = end
+
+        parts.append( self.text[ position: ] )
+
+        return "".join( parts )
+
 
 class SummaryPageEntry():
     """
@@ -99,7 +723,11 @@ class SummaryPageEntry():
 
     write_needed = False
 
-    def __init__( self, entry, force_reload=False ):
+    # Chart category of entries of Template "/Eintrag" without suffix
+    default_category = "Singles"
+
+    def __init__( self, entry, force_reload=False, categories=None,
+                  latest_revid=None ):
         """
         Constructor
 
@@ -108,13 +736,46 @@ class SummaryPageEntry():
         @param force-reload: If given, countrylists will be always parsed
                              regardless if needed or not
         @type force-reload: bool
+        @param categories: Chart categories of all entries of summary page
+                           linking the same countrylist
+        @type categories: tuple
+        @param latest_revid: Latest revision of countrylist, if already
+                             looked up
+        @type latest_revid: int
         """
         self.old_entry = SummaryPageEntryTemplate( entry )
         self.new_entry = SummaryPageEntryTemplate( )
 
+        # Other categories use their own template, e.g. "/Eintrag Alben"
+        self.category = type( self ).get_category( entry )
+        if self.category != type( self ).default_category:
+            self.new_entry.template.name = str( entry.name )
+
+        # Original text of entry to recognise it later on
+        self.key = str( entry )
+
         # Force parsing of countrylist
         self.force_reload = force_reload
 
+        # Chart categories to extract in the same parse of countrylist
+        self.categories = categories
+
+        # Latest revision of countrylist, if known
+        self.latest_revid = latest_revid
+
+    @classmethod
+    def get_category( cls, entry ):
+        """
+        Returns chart category of entry given by suffix of template name
+
+        @param entry: Entry template of summarypage entry
+        @type entry: mwparser.template
+        @rtype    str
+        """
+        suffix = str( entry.name ).strip().rpartition( "/Eintrag" )[2]
+
+        return suffix.strip() or cls.default_category
+
     def treat( self ):
         """
         Controls parsing/update-sequence of entry
@@ -155,28 +816,36 @@ class SummaryPageEntry():
 
         # Try to get current years list
         try:
-            self.countrylist = CountryList( self.countrylist_wikilink )
+            self.countrylist = CountryList( self.countrylist_wikilink,
+                                            category=self.category,
+                                            categories=self.categories,
+                                            latest_revid=self.latest_revid )
 
             self.maybe_parse_countrylist()
 
         # Maybe fallback to last years list
         except CountryListError:
 
-            # If list is from last year, replace year
-            if (current_year ) in self.countrylist_wikilink.title:
-                jogobot.output( "New years list for [[{page}]] does not " +
-                                "exist, fall back to old list!".format(
-                                    page=self.countrylist_wikilink.title ) )
+            with tracing.span( "Year fallback", "entry" ):
+                # If list is from last year, replace year
+                if (current_year ) in self.countrylist_wikilink.title:
+                    jogobot.output(
+                        ( "New years list for [[{page}]] does not " +
+                          "exist, fall back to old list!" ).format(
+                            page=self.countrylist_wikilink.title ) )
 
-                self.countrylist_wikilink.title.replace( current_year,
-                                                         (current_year - 1) )
+                    self.countrylist_wikilink.title.replace(
+                        current_year, (current_year - 1) )
 
-            self.countrylist = CountryList( self.countrylist_wikilink )
+                self.countrylist = CountryList(
+                    self.countrylist_wikilink, category=self.category,
+                    categories=self.categories )
 
-            self.maybe_parse_countrylist()
+                self.maybe_parse_countrylist()
 
-            if not self.countrylist:
-                raise SummaryPageEntryError( "CountryList does not exists!" )
+                if not self.countrylist:
+                    raise SummaryPageEntryError(
+                        "CountryList does not exists!" )
 
     def maybe_parse_countrylist( self ):
         """
@@ -189,9 +858,17 @@ class SummaryPageEntry():
             return
 
         # Parse if needed or forced
-        if( self.countrylist.is_parsing_needed( self.countrylist_revid ) or
-            self.force_reload ):
-                self.countrylist.parse()
+        if self.force_reload:
+            self.countrylist.parse()
+            metrics.inc( "countrylists", result="parsed" )
+
+        # Changes since saved revision may be enough to find latest entry
+        elif self.countrylist.is_parsing_needed( self.countrylist_revid ):
+            self.countrylist.parse( self.countrylist_revid,
+                                    self.old_entry.Titel )
+            metrics.inc( "countrylists", result="parsed" )
+        else:
+            metrics.inc( "countrylists", result="unchanged" )
 
     def get_countrylist_wikilink( self ):
         """
@@ -222,8 +899,7 @@ class SummaryPageEntry():
         """
 
         self.new_entry.Liste = self.countrylist_wikilink
-        self.new_entry.Liste_Revision = \
-            self.countrylist.page.latest_revision_id
+        self.new_entry.Liste_Revision = self.countrylist.latest_revid
         self.new_entry.Interpret = self.countrylist.interpret
         self.new_entry.Titel = self.countrylist.titel
         self.new_entry.Chartein = self._corrected_chartein
@@ -261,10 +937,16 @@ class SummaryPageEntry():
         """
         Detects wether writing of entry is needed and stores information in
         Class-Attribute
+
+        @returns  True if this entry needs to be written
+        @rtype    bool
         """
-        type( self ).write_needed = ( ( self.old_entry != self.new_entry ) and
-                                      self.countrylist.parsed or
-                                      type( self ).write_needed )
+        write_needed = ( ( self.old_entry != self.new_entry ) and
+                         self.countrylist.parsed )
+
+        type( self ).write_needed = write_needed or type( self ).write_needed
+
+        return write_needed
 
     def get_entry( self ):
         """
@@ -304,7 +986,6 @@ class SummaryPageEntryTemplate():
                            mwparser.nodes.template.Template ):
 
                 self.template = template_obj
-                self.__initial = False
 
             # Otherwise raise error
             else:
@@ -313,7 +994,6 @@ class SummaryPageEntryTemplate():
         # Otherwise initialise template
         else:
             self.__initial_template()
-            self.__initial = True
 
     def __initial_template( self ):
         """
@@ -324,16 +1004,57 @@ class SummaryPageEntryTemplate():
 Aktuelle Nummer-eins-Hits/Eintrag|Liste=|Liste_Revision=|Interpret=|Titel=NN\
 |Chartein=|Korrektur=|Hervor=}}" ).ifilter_templates() )
 
+    def get_snapshot( self ):
+        """
+        Returns normalized snapshot of template params, mapping each param
+        name to its stripped value or None if missing. It is built once and
+        rebuilt only after a param was set.
+
+        @rtype    dict
+        """
+        if self.__dict__.get( "_snapshot" ) is None:
+            snapshot = dict.fromkeys( type(self).params )
+            values = dict()
+
+            # Like template.get(), the last occurence of a param counts
+            for param in self.template.params:
+                name = str( param.name ).strip()
+
+                if name in snapshot:
+                    snapshot[ name ] = str( param.value ).strip()
+                    values[ name ] = param.value
+
+            # Liste_Revision is not compared (not just write about Revids),
+            # only its presence
+            compared = tuple(
+                ( snapshot[ name ] is not None ) if name == "Liste_Revision"
+                else snapshot[ name ] for name in type(self).params )
+
+            self.__dict__[ "_snapshot" ] = snapshot
+            self.__dict__[ "_values" ] = values
+            self.__dict__[ "_compared" ] = compared
+            self.__dict__[ "_fingerprint" ] = hash( compared )
+
+        return self.__dict__[ "_snapshot" ]
+
+    def get_fingerprint( self ):
+        """
+        Returns fingerprint of compared param values, equal for entries not
+        differing in other params than Liste_Revision
+        """
+        self.get_snapshot()
+
+        return self.__dict__[ "_fingerprint" ]
+
     def __getattr__( self, name ):
         """
         Special getter for template params
         """
         if name in type(self).params:
 
-            if( self.template.has( name ) ):
-                return self.template.get( name ).value
-            else:
-                return False
+            self.get_snapshot()
+
+            return self.__dict__[ "_values" ].get( name, False )
 
         else:
             raise AttributeError
@@ -346,6 +1067,9 @@ Aktuelle Nummer-eins-Hits/Eintrag|Liste=|Liste_Revision=|Interpret=|Titel=NN\
 
             self.__dict__[ 'template' ].add( name, value )
 
+            # Snapshot is outdated now
+            self.__dict__[ "_snapshot" ] = None
+
         else:
             object.__setattr__(self, name, value)
 
@@ -354,40 +1078,11 @@ Aktuelle Nummer-eins-Hits/Eintrag|Liste=|Liste_Revision=|Interpret=|Titel=NN\
         Checks wether all Template param values except for Liste_Revision are
         equal
         """
-
-        # Detect which of the two was initialised (without)
-        # If none raise error
-        if( self.__initial ):
-            initial = self
-            cmpto = other
-        elif( other.__initial ):
-            initial = other
-            cmpto = self
-        else:
-            raise SummaryPageEntryTemplateError(
-                "One of the compared instances must have been initial!" )
-
-        # Iterate over each param
-        for param in initial.template.params:
-
-            # Slice out only Param.name
-            param = param[:param.find("=")].strip()
-
-            # If param is missing, writing is needed
-            if not cmpto.template.has( param ):
-                return True
-
-            # Do not compare List Revisions (not just write about Revids)
-            if param == "Liste_Revision":
-                continue
-
-            # Compare other param values, if one unequal write is needed
-            if( initial.template.get( param ).value.strip() !=
-                cmpto.template.get( param ).value.strip() ):
-                    return True
-
-        # If not returned True until now
-        return False
+        # Fingerprints differ for nearly all unequal entries, equal ones are
+        # compared exactly to rule out collisions
+        return ( self.get_fingerprint() != other.get_fingerprint() or
+                 self.__dict__[ "_compared" ] !=
+                 other.__dict__[ "_compared" ] )
 
 
 class SummaryPageError( Exception ):
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  test_corpus.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Replays the CountryList corpus offline, one test per snapshot
+
+Offline parsing needs neither wiki access nor jogobot, so modules missing
+or unusable here (e.g. pywikibot without user-config.py, jogobot submodule
+not checked out) are replaced by minimal stand-ins.
+"""
+
+import importlib
+import locale
+import os
+import sys
+import types
+from datetime import date
+
+import pytest
+
+
+def provide( name, required, **attrs ):
+    """
+    Import module, or register a stand-in with given attributes if it can
+    not be imported or lacks the required attribute
+    """
+    try:
+        if hasattr( importlib.import_module( name ), required ):
+            return
+    except Exception:
+        pass
+
+    # Drop remainders of failed import
+    for module in list( sys.modules ):
+        if module == name or module.startswith( name + "." ):
+            del sys.modules[ module ]
+
+    module = types.ModuleType( name )
+    module.__dict__.update( attrs )
+    sys.modules[ name ] = module
+
+    return module
+
+
+class Unavailable():
+    """
+    Stands in for classes needing access to the wiki
+    """
+
+    def __init__( self, *args, **kwargs ):
+        raise RuntimeError( "Not available offline" )
+
+
+class Week():
+    """
+    Stands in for isoweek.Week
+    """
+
+    def __init__( self, year, week ):
+        self.year = year
+        self.week = week
+
+    def monday( self ):
+        return date.fromisocalendar( self.year, self.week, 1 )
+
+
+error = type( "Error", ( Exception, ), dict() )
+pywikibot = provide( "pywikibot", "Page", Error=error, Site=Unavailable,
+                     Page=Unavailable )
+if pywikibot:
+    api = types.ModuleType( "pywikibot.data.api" )
+    api.Request = Unavailable
+    api.APIError = type( "APIError", ( error, ), dict() )
+    pywikibot.data = types.ModuleType( "pywikibot.data" )
+    pywikibot.data.api = api
+    sys.modules[ "pywikibot.data" ] = pywikibot.data
+    sys.modules[ "pywikibot.data.api" ] = api
+
+provide( "jogobot", "output", output=lambda *args, **kwargs: None )
+provide( "isoweek", "Week", Week=Week )
+
+from corpus import CorpusReplay  # noqa: E402
+
+
+replay = CorpusReplay( os.path.join(
+    os.path.dirname( os.path.abspath( __file__ ) ), "corpus" ) )
+
+
+@pytest.mark.parametrize( "name", replay.get_snapshots() )
+def test_snapshot( name, monkeypatch ):
+    """
+    Parse snapshot and compare with its expected values
+    """
+    # Results do not depend on locale, which may not be installed
+    monkeypatch.setattr( locale, "setlocale", lambda *args: None )
+
+    errors, elapsed = replay.check( name )
+
+    assert not errors
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  timeouts.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides timeouts, retries with jitter and hedged duplicates for API read
+requests, used as hook around pywikibot API requests
+
+A request not answered within the hedging delay is sent a second time and
+the first answer of both is taken. If none arrives within the timeout, the
+request is retried after a growing, randomized pause. Requests abandoned
+this way keep running in the background, their answers are dropped.
+
+Bounded requests are sent without the retries of pywikibot, so abandoned
+requests do not keep retrying in the background and retries do not stack.
+"""
+
+import queue
+import random
+import threading
+import time
+
+import pywikibot
+from pywikibot.data import api
+
+import apihooks
+import metrics
+
+
+class RequestTimeouts():
+    """
+    Bounds the duration of read requests
+    """
+
+    # Actions which do not change anything on the wiki and may be repeated
+    read_actions = ( "query", "parse", "compare" )
+
+    def __init__( self, timeout=30.0, retries=2, hedge=None, backoff=1.0 ):
+        """
+        Constructor
+
+        @param timeout: Seconds to wait for answer of each attempt
+        @type timeout: float
+        @param retries: Number of attempts after first one timed out
+        @type retries: int
+        @param hedge: Seconds after which a duplicate request is sent within
+                      an attempt, None to disable
+        @type hedge: float
+        @param backoff: Mean pause before first retry in seconds, doubled
+                        for each further one
+        @type backoff: float
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.backoff = backoff
+
+    def activate( self ):
+        """
+        Start bounding requests
+        """
+        apihooks.add( self.bound_request )
+
+    def deactivate( self ):
+        """
+        Stop bounding requests
+        """
+        apihooks.remove( self.bound_request )
+
+    @staticmethod
+    def duplicate( request ):
+        """
+        Returns new request with the same params as given one, without
+        retries of pywikibot
+        """
+        return api.Request( site=request.site,
+                            parameters=dict( request._params ),
+                            max_retries=0 )
+
+    def bound_request( self, request, submit ):
+        """
+        API hook sending read requests with timeout, retries and hedging
+        """
+        action = apihooks.get_action( request )
+
+        if action not in type( self ).read_actions:
+            return submit()
+
+        # Failed attempts are retried here instead
+        request.max_retries = 0
+
+        for attempt in range( self.retries + 1 ):
+            if attempt:
+                time.sleep( self.backoff * 2 ** ( attempt - 1 ) *
+                            random.uniform( 0.5, 1.5 ) )
+                metrics.inc( "api_retries", action=action )
+
+                # Abandoned request may still be sent, do not share it
+                request = type( self ).duplicate( request )
+
+            try:
+                return self.race( request, submit, action )
+            except RequestTimeout as error:
+                metrics.inc( "api_timeouts", action=action )
+                last = error
+
+            # Connection or server error, pywikibot would have retried it
+            except api.TimeoutError as error:
+                metrics.inc( "api_timeouts", action=action )
+                last = RequestTimeout( "{action} request failed: {error}"
+                                       .format( action=action,
+                                                error=error ) )
+
+        raise last
+
+    def race( self, request, submit, action ):
+        """
+        Send request in background thread, maybe hedged by a duplicate, and
+        return first answer or raise first error of them
+
+        @raises RequestTimeout: No answer within timeout
+        """
+        outcomes = queue.Queue()
+
+        def send( current ):
+            try:
+                outcomes.put( ( True, submit( current ) ) )
+            except Exception as error:
+                outcomes.put( ( False, error ) )
+
+        def start( current ):
+            threading.Thread( target=send, args=( current, ),
+                              daemon=True ).start()
+
+        start( request )
+        pending = 1
+        hedged = not self.hedge or self.hedge >= self.timeout
+
+        now = time.monotonic()
+        end = now + self.timeout
+
+        while True:
+            wait = end - now if hedged else self.hedge
+
+            try:
+                success, value = outcomes.get( timeout=max( wait, 0 ) )
+            except queue.Empty:
+                now = time.monotonic()
+
+                if hedged or now >= end:
+                    raise RequestTimeout( ( "No answer to {action} " +
+                                            "request within {timeout} s" )
+                                          .format( action=action,
+                                                   timeout=self.timeout ) )
+
+                metrics.inc( "api_hedged", action=action )
+                start( type( self ).duplicate( request ) )
+                pending += 1
+                hedged = True
+                continue
+
+            pending -= 1
+
+            # Error of one request may be answered by the other one
+            if success or not pending:
+                break
+
+            now = time.monotonic()
+
+        if success:
+            return value
+
+        raise value
+
+
+class RequestTimeout( pywikibot.Error ):
+    """
+    Handles requests not answered in time
+    """
+    pass
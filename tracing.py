@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  tracing.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides recording of nested spans of a run, exported in Chrome trace event
+format for viewing in chrome://tracing or Perfetto
+
+Spans are opened with the module function span() at the relevant places in
+the code. If no Tracer is active, span() does nothing.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import apihooks
+
+
+class Tracer():
+    """
+    Records spans and writes them as Chrome trace file
+    """
+
+    # Currently active Tracer instance, used by module function span()
+    active = None
+
+    def __init__( self, path ):
+        """
+        Constructor
+
+        @param path: File to write trace to
+        @type path: str
+        """
+        self.path = path
+        self.events = list()
+
+        self._pid = os.getpid()
+        self._start = time.perf_counter()
+
+    def activate( self ):
+        """
+        Make this instance the active one and start tracing API requests
+        """
+        type( self ).active = self
+        apihooks.add( self.trace_request )
+
+    def deactivate( self ):
+        """
+        Stop tracing
+        """
+        apihooks.remove( self.trace_request )
+
+        if type( self ).active is self:
+            type( self ).active = None
+
+    def _now( self ):
+        """
+        Returns microseconds since creation of Tracer
+        """
+        return ( time.perf_counter() - self._start ) * 1e6
+
+    @contextmanager
+    def span( self, name, category, **args ):
+        """
+        Record enclosed code as span
+
+        @param name: Name of span
+        @type name: str
+        @param category: Category of span, e.g. "page" or "api"
+        @type category: str
+        @param args: Additional information shown for span
+        """
+        start = self._now()
+
+        try:
+            yield args
+        except Exception as error:
+            args["error"] = repr( error )
+            raise
+        finally:
+            self.events.append( {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start,
+                "dur": self._now() - start,
+                "pid": self._pid,
+                "tid": threading.get_ident(),
+                "args": { key: str( value ) for key, value in args.items() }
+            } )
+
+    def trace_request( self, request, submit ):
+        """
+        API hook recording a span per request
+        """
+        params = getattr( request, "_params", dict() )
+
+        with self.span( "API " + apihooks.get_action( request ), "api",
+                        **{ key: "|".join( str( item ) for item in value )
+                            if isinstance( value, list ) else value
+                            for key, value in params.items()
+                            if key != "text" and
+                            not apihooks.is_secret( key ) } ):
+            return submit()
+
+    def write( self ):
+        """
+        Write recorded spans to file
+        """
+        with open( self.path, "w", encoding="utf-8" ) as fd:
+            json.dump( { "traceEvents": self.events,
+                         "displayTimeUnit": "ms" }, fd, ensure_ascii=False )
+
+
+@contextmanager
+def span( name, category="charts", **args ):
+    """
+    Record enclosed code as span of active Tracer, if any
+
+    Yields dict of args, which may be extended within the span
+    """
+    if Tracer.active:
+        with Tracer.active.span( name, category, **args ) as args:
+            yield args
+    else:
+        yield args
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8  -*-
+#
+#  traffic.py
+#
+#  Copyright 2016 Jonathan Golder <jonathan@golderweb.de>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Provides recording of all API requests and responses of a run into a
+gzipped archive and replaying them later, used as hooks around pywikibot API
+requests
+
+While replaying, no request reaches the wiki, so a slow run can be
+reproduced and profiled as often as needed.
+"""
+
+import gzip
+import json
+import time
+from collections import deque
+
+import pywikibot
+from pywikibot.data import api
+
+import jogobot
+
+import apihooks
+import metrics
+
+
+def get_params( request ):
+    """
+    Returns params of request as dict of strings, without secrets, which
+    must not be stored and do not identify a request
+    """
+    return { key: "|".join( str( item ) for item in value )
+             if isinstance( value, list ) else str( value )
+             for key, value in getattr( request, "_params", dict() ).items()
+             if not apihooks.is_secret( key ) }
+
+
+def redact( response ):
+    """
+    Returns copy of response with values of secret fields (e.g. tokens
+    of action=query&meta=tokens or login) replaced by empty strings
+    """
+    if isinstance( response, dict ):
+        return { key: "" if apihooks.is_secret( key ) else redact( value )
+                 for key, value in response.items() }
+    elif isinstance( response, list ):
+        return [ redact( item ) for item in response ]
+
+    return response
+
+
+def get_key( params ):
+    """
+    Returns key identifying request with params
+    """
+    return json.dumps( sorted( params.items() ), ensure_ascii=False )
+
+
+class TrafficRecorder():
+    """
+    Writes each API request with its response or error and duration as one
+    JSON record per line into a gzipped file
+    """
+
+    def __init__( self, path ):
+        """
+        Constructor
+
+        @param path: File to write archive to
+        @type path: str
+        """
+        self.path = path
+        self.fd = None
+        self.count = 0
+
+    def activate( self ):
+        """
+        Open archive and start recording
+        """
+        self.fd = gzip.open( self.path, "wt", encoding="utf-8" )
+        apihooks.add( self.record_request )
+
+    def deactivate( self ):
+        """
+        Stop recording and close archive
+        """
+        apihooks.remove( self.record_request )
+
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+
+    def record_request( self, request, submit ):
+        """
+        API hook recording request and result
+        """
+        record = { "params": get_params( request ) }
+        start = time.perf_counter()
+
+        try:
+            response = submit()
+            record["response"] = redact( response )
+            return response
+
+        except api.APIError as error:
+            record["error"] = { "code": error.code, "info": error.info }
+            raise
+
+        except Exception as error:
+            record["error"] = { "info": repr( error ) }
+            raise
+
+        finally:
+            record["elapsed"] = time.perf_counter() - start
+
+            # Interrupted requests have no outcome to replay
+            if "response" in record or "error" in record:
+                self.fd.write( json.dumps( record, ensure_ascii=False ) +
+                               "\n" )
+                self.fd.flush()
+                self.count += 1
+
+
+class TrafficReplayer():
+    """
+    Answers API requests with responses from archive instead of sending them
+    to the wiki
+
+    Requests are matched by their params. If a request was not recorded
+    identically, the next unused record of the same action is taken, as
+    the run replays in the same order. Such fallbacks are reported, as
+    they may answer a request with the response of another one.
+    """
+
+    def __init__( self, path, timing=False ):
+        """
+        Constructor
+
+        @param path: Archive written by TrafficRecorder
+        @type path: str
+        @param timing: Sleep as long as the original request took
+        @type timing: bool
+        """
+        self.path = path
+        self.timing = timing
+
+        self.records = list()
+        self.used = set()
+
+        # Number of requests answered by a record of other params
+        self.fallbacks = 0
+
+        # Indexes of records by key and by action, in recorded order
+        self.by_key = dict()
+        self.by_action = dict()
+
+    def load( self ):
+        """
+        Read all records from archive
+        """
+        with gzip.open( self.path, "rt", encoding="utf-8" ) as fd:
+            for line in fd:
+                try:
+                    record = json.loads( line )
+                except ValueError:
+                    # Archive of aborted run may end with incomplete line
+                    break
+
+                index = len( self.records )
+                self.records.append( record )
+
+                self.by_key.setdefault( get_key( record["params"] ),
+                                        deque() ).append( index )
+                self.by_action.setdefault( record["params"].get( "action" ),
+                                           deque() ).append( index )
+
+    def activate( self ):
+        """
+        Load archive and start replaying
+        """
+        self.load()
+        apihooks.add( self.replay_request )
+
+    def deactivate( self ):
+        """
+        Stop replaying
+        """
+        apihooks.remove( self.replay_request )
+
+    def _next( self, indexes ):
+        """
+        Returns next unused record from given queue of indexes or None
+        """
+        while indexes:
+            index = indexes.popleft()
+
+            if index not in self.used:
+                self.used.add( index )
+                return self.records[ index ]
+
+        return None
+
+    def replay_request( self, request, submit ):
+        """
+        API hook answering request from archive
+        """
+        params = get_params( request )
+
+        record = self._next( self.by_key.get( get_key( params ), deque() ) )
+        if record is None:
+            record = self._next( self.by_action.get( params.get( "action" ),
+                                                     deque() ) )
+
+            if record is not None:
+                self.fallbacks += 1
+                metrics.inc( "replay_fallbacks",
+                             action=params.get( "action" ) )
+                jogobot.output( ( "Request not in archive, replaying record " +
+                                  "of other params: {params}" ).format(
+                                      params=params ), "WARNING" )
+
+        if record is None:
+            raise ReplayError( "Request not in archive: {params}".format(
+                params=params ) )
+
+        if self.timing:
+            time.sleep( record["elapsed"] )
+
+        if "error" in record:
+            if "code" in record["error"]:
+                raise api.APIError( record["error"]["code"],
+                                    record["error"]["info"] )
+
+            raise ReplayError( record["error"]["info"] )
+
+        if "response" not in record:
+            raise ReplayError( "Record has no response: {params}".format(
+                params=record["params"] ) )
+
+        return record["response"]
+
+    def get_unused( self ):
+        """
+        Returns number of records not replayed
+        """
+        return len( self.records ) - len( self.used )
+
+
+class ReplayError( pywikibot.Error ):
+    """
+    Handles errors occuring while replaying traffic
+    """
+    pass